@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the hot paths of the CPS library (building a CPS, transposing it,
+finding embedded CPS and common tones, listing scales and octave reduction),
+over a range of set sizes. Reports time and peak memory, and can save the
+results as a JSON baseline or compare them to one.
+
+Examples:
+    python bench_cps.py --save bench_baseline.json
+    python bench_cps.py --compare bench_baseline.json
+    python bench_cps.py -s eikosany,8c4 -b init,transpose
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from cps import CPS, Ratio
+
+
+PRIMES = [1, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+
+# name -> (number of factors, choose)
+SIZES = {
+    "hexany": (4, 2),
+    "dekany": (5, 2),
+    "eikosany": (6, 3),
+    "8c4": (8, 4),
+    "10c5": (10, 5),
+}
+
+# timed runs per benchmark; the best of them is compared to the baseline, as
+# the smaller sets take only microseconds and single runs are noisy
+REPEAT = 20
+
+# a result is slower than the baseline if it takes this much longer
+TOLERANCE = 0.2
+
+
+def _factors(size: str) -> Tuple[List[int], int]:
+    n, choose = SIZES[size]
+    return PRIMES[:n], choose
+
+
+def _embedded(cps: CPS) -> List[CPS]:
+    # the largest family with a multiplier, e.g. the hexanies in an eikosany
+    return cps.find_embedded_cps(max(len(cps.factors) - 2, cps.choose), cps.choose - 1)
+
+
+def _divisor(cps: CPS) -> Tuple[int, str]:
+    elm = cps.elements[-1]
+    return elm.product, '*'.join(str(f) for f in elm.factors)
+
+
+def _setup_none(factors: List[int], choose: int) -> Tuple[List[int], int]:
+    return factors, choose
+
+
+def _setup_cps(factors: List[int], choose: int) -> CPS:
+    return CPS(factors, choose)
+
+
+def _setup_embedded(factors: List[int], choose: int) -> List[CPS]:
+    return _embedded(CPS(factors, choose))
+
+
+def _setup_ratios(factors: List[int], choose: int) -> List[Ratio]:
+    cps = CPS(factors, choose)
+    divisor = cps.elements[-1].product
+    return [Ratio(elm.product, divisor) for elm in cps.elements]
+
+
+def _bench_init(args: Tuple[List[int], int]) -> Any:
+    return CPS(*args)
+
+
+def _bench_transpose(cps: CPS) -> Any:
+    return cps.transpose(*_divisor(cps))
+
+
+def _bench_find_embedded_cps(cps: CPS) -> Any:
+    return _embedded(cps)
+
+
+def _bench_find_common_tones(cps_list: List[CPS]) -> Any:
+    return CPS.find_common_tones(cps_list)
+
+
+def _bench_list_scale(cps: CPS) -> Any:
+    return cps.list_scale(), cps.list_scale(tabular=True, csv=True)
+
+
+def _bench_list_scale_tabular(cps_list: List[CPS]) -> Any:
+    return [cps.list_scale(tabular=True, csv=True) for cps in cps_list]
+
+
+def _bench_octave_reduce(ratios: List[Ratio]) -> Any:
+    return [Ratio.octave_reduce(r) for r in ratios]
+
+
+# name -> (setup, benchmark); setup runs before every timed call and is not
+# timed, so that per-instance caches (e.g. of transpositions) start out empty
+BENCHMARKS: Dict[str, Tuple[Callable, Callable]] = {
+    "init": (_setup_none, _bench_init),
+    "transpose": (_setup_cps, _bench_transpose),
+    "find_embedded_cps": (_setup_cps, _bench_find_embedded_cps),
+    "find_common_tones": (_setup_embedded, _bench_find_common_tones),
+    "list_scale": (_setup_cps, _bench_list_scale),
+    "list_scale_tabular": (_setup_embedded, _bench_list_scale_tabular),
+    "octave_reduce": (_setup_ratios, _bench_octave_reduce),
+}
+
+
+def run_benchmark(name: str, size: str, repeat: int = REPEAT) -> Dict[str, Any]:
+    """
+    Run one benchmark on one set size. Returns the best and median time of
+    repeat runs (in seconds), and the peak memory allocated by one more run,
+    traced separately so that tracing doesn't distort the timings.
+    """
+    setup, bench = BENCHMARKS[name]
+    factors, choose = _factors(size)
+
+    times = []
+    for _ in range(repeat):
+        arg = setup(factors, choose)
+        start = time.perf_counter()
+        bench(arg)
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    arg = setup(factors, choose)
+    tracemalloc.start()
+    try:
+        bench(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "benchmark": name,
+        "size": size,
+        "best": times[0],
+        "median": times[len(times) // 2],
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(names: List[str], sizes: List[str], repeat: int = REPEAT) -> List[Dict[str, Any]]:
+    return [run_benchmark(name, size, repeat) for size in sizes for name in names]
+
+
+def compare(results: List[Dict[str, Any]],
+            baseline: List[Dict[str, Any]],
+            tolerance: float = TOLERANCE) -> List[Dict[str, Any]]:
+    """
+    Add the ratio of each result's best time to the baseline's (where the
+    baseline has the same benchmark and size), and return the results that are
+    slower than the baseline by more than tolerance.
+    """
+    base = {(r["benchmark"], r["size"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = base.get((result["benchmark"], result["size"]))
+        if old is None or not old["best"]:
+            continue
+        result["vs_baseline"] = result["best"] / old["best"]
+        result["peak_vs_baseline"] = result["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] else None
+        if result["vs_baseline"] > 1 + tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'size':<10} {'benchmark':<20} {'best ms':>10} {'median ms':>10} {'peak KiB':>10} {'vs base':>8}"]
+    for r in results:
+        ratio = f"{r['vs_baseline']:.2f}x" if "vs_baseline" in r else ""
+        lines.append(f"{r['size']:<10} {r['benchmark']:<20} {r['best'] * 1000:>10.3f} "
+                     f"{r['median'] * 1000:>10.3f} {r['peak_bytes'] / 1024:>10.1f} {ratio:>8}")
+    return '\n'.join(lines)
+
+
+def name_list(choices: List[str]) -> Callable[[str], List[str]]:
+    def parse(s: str) -> List[str]:
+        names = s.split(',')
+        for name in names:
+            if name not in choices:
+                raise argparse.ArgumentTypeError(f"{name} is not one of {', '.join(choices)}")
+        return names
+    return parse
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the CPS library",
+        prog="bench_cps.py"
+    )
+
+    parser.add_argument("-s", "--sizes", help="Comma-separated set sizes (default: all)",
+                        action="store", dest="sizes", type=name_list(list(SIZES)), default=list(SIZES))
+    parser.add_argument("-b", "--benchmarks", help="Comma-separated benchmarks (default: all)",
+                        action="store", dest="benchmarks", type=name_list(list(BENCHMARKS)),
+                        default=list(BENCHMARKS))
+    parser.add_argument("-r", "--repeat", help="Timed runs per benchmark (default: %(default)s)",
+                        action="store", dest="repeat", type=int, default=REPEAT)
+    parser.add_argument("--save", help="Save the results as a JSON baseline",
+                        action="store", dest="save", default=None)
+    parser.add_argument("--compare", help="Compare the results to a JSON baseline",
+                        action="store", dest="compare", default=None)
+    parser.add_argument("--tolerance", help="Allowed slowdown vs. the baseline (default: %(default)s)",
+                        action="store", dest="tolerance", type=float, default=TOLERANCE)
+
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    results = run_benchmarks(args.benchmarks, args.sizes, args.repeat)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+
+    print(format_results(results))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than "
+              f"{args.tolerance:.0%}:", file=sys.stderr)
+        for r in regressions:
+            print(f"    {r['size']} {r['benchmark']}: {r['vs_baseline']:.2f}x", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,231 @@
 from __future__ import annotations
 
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from copy import copy
 from fractions import Fraction
-from functools import reduce
-from itertools import combinations, repeat
+from functools import lru_cache, reduce
+from itertools import combinations
 import math
 from operator import mul
-from pprint import pformat
-from typing import Dict, List, Set, Tuple
+import re
+import sys
+from threading import Lock
+import time
+from typing import IO, Dict, Iterable, Iterator, List, Sequence, Set, Tuple, Union
+
+
+# number of transposed views of a CPS kept in its cache
+TRANSPOSITION_CACHE_SIZE = 128
+
+# divisions of the octave used for o_C note values
+O_C_RESOLUTION = 1536
+
+_LOG_2 = math.log(2)
+
+# number of parsed factor specs (e.g. "1*3*5") kept by parse_factors()
+FACTOR_SPEC_CACHE_SIZE = 4096
+
+_FACTOR_SPEC = re.compile(r"\s*[1-9]\d*(\s*\*\s*[1-9]\d*)*\s*")
+
+# optional persistent cache of element tables, see set_cache() and cps_cache.py
+_cache = None
+
+
+def set_cache(cache) -> None:
+    """
+    Use cache (e.g., a cps_cache.CpsCache, or None to turn caching off) to look
+    up and store the elements of every CPS and transposition that gets built.
+    """
+    global _cache
+    _cache = cache
+
+
+class Stats(object):
+    """
+    Call counters and per-phase timers (in seconds), filled in by the library
+    while profiling is on; see profile() and set_stats().
+    """
+    def __init__(self):
+        self.counters = Counter()
+        self.timers = Counter()
+        self.calls = Counter()
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def add_time(self, name: str, start: float) -> None:
+        """
+        Add the time since start (a time.perf_counter() value) to a phase.
+        """
+        self.timers[name] += time.perf_counter() - start
+        self.calls[name] += 1
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, start)
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.timers.clear()
+        self.calls.clear()
+
+    def as_dict(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        return {
+            "counters": dict(self.counters),
+            "timers": dict(self.timers),
+            "calls": dict(self.calls),
+        }
+
+    def report(self) -> str:
+        lines = [f"{'phase':<20} {'calls':>8} {'total ms':>10}"]
+        for name, seconds in sorted(self.timers.items(), key=lambda t: -t[1]):
+            lines.append(f"{name:<20} {self.calls[name]:>8} {seconds * 1000:>10.3f}")
+        lines.append("")
+        lines.append(f"{'counter':<30} {'count':>8}")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f"{name:<30} {n:>8}")
+        return '\n'.join(lines)
+
+
+# active Stats, or None when profiling is off (the default), see set_stats()
+_stats = None
+
+_NO_TIMER = nullcontext()
+
+
+def set_stats(stats: Union[Stats, None]) -> None:
+    """
+    Record counters and timers in stats from now on (None turns profiling off).
+    """
+    global _stats
+    _stats = stats
+
+
+@contextmanager
+def profile(stats: Stats = None) -> Iterator[Stats]:
+    """
+    Turn profiling on for the duration of a with block, e.g.
+
+        with profile() as stats:
+            CPS([1, 3, 5, 7, 11, 13], 3).find_embedded_cps(4, 2)
+        print(stats.report())
+    """
+    previous = _stats
+    set_stats(stats if stats is not None else Stats())
+    try:
+        yield _stats
+    finally:
+        set_stats(previous)
+
+
+def _timer(name: str):
+    return _stats.timer(name) if _stats is not None else _NO_TIMER
+
+
+def _count(name: str, n: int = 1) -> None:
+    if _stats is not None:
+        _stats.counters[name] += n
+
+
+def octave_reduce_pair(num: int, den: int) -> Tuple[int, int]:
+    """
+    Octave reduce the ratio num/den (positive, in lowest terms) in constant time,
+    using bit lengths instead of repeated halving. Follows the same convention as
+    Ratio.octave_reduce: values greater than 2 are halved until they are <= 2,
+    smaller values are left as they are.
+    """
+    shift = max(0, num.bit_length() - den.bit_length() - 1)
+    if num > den << (shift + 1):
+        shift += 1
+    if not shift:
+        return num, den
+    # move as many factors of 2 as possible out of the numerator, the rest
+    # into the denominator, which keeps the result in lowest terms
+    zeros = min((num & -num).bit_length() - 1, shift)
+    return num >> zeros, den << (shift - zeros)
+
+
+def divide_product(prod: int, divisor: int) -> Tuple[int, int]:
+    """
+    prod/divisor (as a num/den pair in lowest terms), after raising prod by the
+    smallest number of octaves that brings it up to at least the divisor.
+    """
+    shift = max(0, divisor.bit_length() - prod.bit_length())
+    if prod << shift < divisor:
+        shift += 1
+    prod <<= shift
+    gcd = math.gcd(prod, divisor)
+    return prod // gcd, divisor // gcd
+
+
+def pitch(num: int, den: int) -> float:
+    """
+    log2 of the ratio num/den, i.e. its size in octaves.
+    """
+    return math.log(num / den) / _LOG_2
+
+
+def combination_rank(indices: Sequence[int], n: int) -> int:
+    """
+    Position of a sorted combination of indices in the sequence generated by
+    itertools.combinations(range(n), len(indices)).
+    """
+    k = len(indices)
+    rank = 0
+    prev = -1
+    for j, i in enumerate(indices):
+        # count the combinations that start with a smaller index at this position
+        rank += math.comb(n - prev - 1, k - j) - math.comb(n - i, k - j)
+        prev = i
+    return rank
+
+
+def popcount(mask: int) -> int:
+    """
+    Number of bits set in a (non-negative) mask.
+    """
+    return bin(mask).count('1')
+
+
+@lru_cache(maxsize=FACTOR_SPEC_CACHE_SIZE)
+def parse_factors(spec: str) -> Tuple[int, ...]:
+    """
+    Parse a product of factors written as in list_factors(stars=True), e.g.
+    "1*3*5", into a tuple of (positive) ints. Results are cached, so parsing
+    the same spec again returns the same tuple.
+    """
+    if not isinstance(spec, str) or not _FACTOR_SPEC.fullmatch(spec):
+        raise ValueError(f"Invalid factor spec: {spec!r}")
+    return tuple(int(f) for f in spec.split('*'))
+
+
+def parse_product(spec: str) -> int:
+    """
+    Value of a product of factors such as "1*3*5".
+    """
+    return reduce(mul, parse_factors(spec), 1)
+
+
+@lru_cache(maxsize=FACTOR_SPEC_CACHE_SIZE)
+def parse_transposition(spec: str) -> Tuple[int, str]:
+    """
+    Parse a transposition spec such as "1*3*5" into the (divisor, label) pair
+    taken by CPS.transpose() and find_embedded_cps().
+    """
+    return parse_product(spec), spec.strip()
+
+
+def ratio_str(num: int, den: int) -> str:
+    """
+    Format num/den the way str(Fraction) does.
+    """
+    return f"{num}/{den}" if den != 1 else f"{num}"
 
 
 class Ratio(Fraction):
@@ -15,10 +234,12 @@ class Ratio(Fraction):
     """
     @classmethod
     def octave_reduce(cls, thing: Ratio) -> Ratio:
-        half = Ratio(1, 2)
-        while thing > 2:
-            thing *= half
-        return thing
+        if _stats is not None:
+            _stats.counters["octave_reduce"] += 1
+        if thing <= 2:
+            return thing
+        thing = Fraction(thing)
+        return cls(*octave_reduce_pair(thing.numerator, thing.denominator))
 
 
 class CpsElement(object):
@@ -27,6 +248,9 @@ class CpsElement(object):
     suppport for an optional multiplier for use with a CPS embedded within
     a larger CPS (e.g., hexanies within an eikosany).
     """
+    __slots__ = ('_size', '_factors', '_multiplier', '_orig_product', '_product', '_num', '_den', '_frac',
+                 '_rank')
+
     def __init__(self,
                  factors: List[int],
                  multiplier: int = None):
@@ -40,8 +264,37 @@ class CpsElement(object):
         if self._multiplier:
             self._factors = tuple(sorted(self._factors + (self._multiplier,)))
 
-        self._orig_product = self._product = reduce(mul, self._factors, 1)
-        self._frac = self.reduce()
+        # the product and the reduced ratio are kept as numerator/denominator
+        # int pairs, Ratio objects are only created when asked for
+        self._orig_product = reduce(mul, self._factors, 1)
+        self._product = (self._orig_product, 1)
+        self._num, self._den = octave_reduce_pair(self._orig_product, 1)
+        self._frac = None
+
+        # position of the combination in its CPS, see combination_rank()
+        self._rank = None
+
+    @classmethod
+    def from_parts(cls,
+                   factors: Tuple[int, ...],
+                   orig_product: int,
+                   product: Tuple[int, int],
+                   ratio: Tuple[int, int],
+                   rank: int = None) -> CpsElement:
+        """
+        Create an element from values that have already been computed elsewhere
+        (e.g., by a batch build), skipping the arithmetic done by __init__.
+        """
+        elm = cls.__new__(cls)
+        elm._size = len(factors)
+        elm._factors = factors
+        elm._multiplier = 0
+        elm._orig_product = orig_product
+        elm._product = product
+        elm._num, elm._den = ratio
+        elm._frac = None
+        elm._rank = rank
+        return elm
 
     @property
     def factors(self) -> List[int]:
@@ -49,75 +302,577 @@ class CpsElement(object):
 
     @property
     def product(self) -> Ratio:
-        return self._product
+        num, den = self._product
+        return num if den == 1 else Ratio(num, den)
 
     @property
     def ratio(self) -> str:
-        return f"{self._frac if self._frac > 1 else '1/1'}"
+        return ratio_str(self._num, self._den) if self._num > self._den else '1/1'
 
     @property
     def ratio_n(self) -> Ratio:
+        if self._frac is None:
+            self._frac = Ratio(self._num, self._den)
         return self._frac
 
     @property
     def o_C_note(self) -> int:
-        return round(1536 * (math.log(self._frac) / math.log(2)))
+        return self.note(O_C_RESOLUTION)
+
+    def note(self, resolution: int) -> int:
+        """
+        The ratio as a step of an equal division of the octave into resolution steps.
+        """
+        return round(resolution * pitch(self._num, self._den))
 
     def reduce(self) -> Ratio:
-        return Ratio.octave_reduce(self._product)
+        return Ratio(*octave_reduce_pair(*self._product))
 
     def div(self, divisor: int) -> CpsElement:
-        prod = self._orig_product
-        while divisor > prod:
-            prod *= 2
-        self._product = prod / Ratio(divisor)
-        self._frac = self.reduce()
+        self._product = self._divided(divisor)
+        self._num, self._den = octave_reduce_pair(*self._product)
+        self._frac = None
         return self
 
+    def transposed(self, divisor: int) -> CpsElement:
+        """
+        Like div(), but returns a new element and leaves this one unchanged.
+        """
+        product = self._divided(divisor)
+        elm = CpsElement.from_parts(self._factors, self._orig_product, product, octave_reduce_pair(*product),
+                                    rank=self._rank)
+        elm._size = self._size
+        elm._multiplier = self._multiplier
+        return elm
+
+    def _divided(self, divisor: int) -> Tuple[int, int]:
+        return divide_product(self._orig_product, divisor)
+
+    def sort_key(self, denominator: int) -> int:
+        """
+        Exact integer sort key, given a common multiple of the denominators
+        of all the elements being sorted.
+        """
+        return self._num * (denominator // self._den)
+
     def __lt__(self, other: CpsElement) -> bool:
         if not isinstance(other, CpsElement):
             raise ValueError("Must compare against same type")
-        return self._frac < other._frac
+        return self._num * other._den < other._num * self._den
 
     def __str__(self) -> str:
         return f"{self._factors}\t=>\t{self.ratio}"
 
 
+def _cache_key(factors: List[int], choose: int, multiplier: Union[int, None], divisor: int) -> Tuple:
+    return tuple(factors), choose, multiplier or 0, divisor
+
+
+def _pack(column: Union[array, List[int], None]) -> Union[bytes, List[int], None]:
+    """
+    A column as stored in the persistent cache: the raw bytes of an array, or
+    a list of ints that don't fit in one.
+    """
+    return column.tobytes() if isinstance(column, array) else column
+
+
+def _unpack(value: Union[bytes, List[int], None], typecode: str = 'q') -> Union[array, List[int], None]:
+    if not isinstance(value, bytes):
+        return value
+    column = array(typecode)
+    column.frombytes(value)
+    return column
+
+
+def _index_typecode(factors: Sequence[int]) -> str:
+    return 'B' if len(factors) <= 256 else 'H'
+
+
+def _load_elements(factors: List[int],
+                   choose: int,
+                   multiplier: Union[int, None],
+                   divisor: int,
+                   compact: bool = False) -> Union[List[CpsElement], CompactElements, None]:
+    """
+    Look up the sorted elements of a CPS transposition in the persistent cache.
+    The table holds every column an element needs, so nothing is recomputed:
+    a compact table is a handful of array copies, and elements are created
+    directly from the columns.
+    """
+    table = _cache.get(_cache_key(factors, choose, multiplier, divisor))
+    if table is None:
+        _count("persistent_cache_misses")
+        return None
+    _count("persistent_cache_hits")
+    indices, ranks, prod_nums, prod_dens, nums, dens = table
+    indices = _unpack(indices, _index_typecode(factors))
+    if compact:
+        return CompactElements(factors, choose, multiplier, indices, _unpack(ranks),
+                               _unpack(prod_nums), _unpack(prod_dens), _unpack(nums), _unpack(dens))
+
+    # factors of each element, in the same (sorted) order as CpsElement's
+    values = iter(map(factors.__getitem__, indices))
+    combos = list(zip(*[values] * choose))
+    if multiplier:
+        combos = [tuple(sorted(combo + (multiplier,))) for combo in combos]
+    elif any(a > b for a, b in zip(factors, factors[1:])):
+        combos = [tuple(sorted(combo)) for combo in combos]
+    prod_nums, prod_dens = _unpack(prod_nums), _unpack(prod_dens)
+    orig_products = prod_nums if divisor == 1 else list(map(math.prod, combos))
+
+    ranks = _unpack(ranks) if ranks is not None else [None] * len(combos)
+    new = CpsElement.__new__
+    elements = []
+    for combo, orig_product, product, num, den, rank in zip(combos, orig_products, zip(prod_nums, prod_dens),
+                                                            _unpack(nums), _unpack(dens), ranks):
+        elm = new(CpsElement)
+        elm._size = choose
+        elm._factors = combo
+        elm._multiplier = multiplier or 0
+        elm._orig_product = orig_product
+        elm._product = product
+        elm._num = num
+        elm._den = den
+        elm._frac = None
+        elm._rank = rank
+        elements.append(elm)
+    return elements
+
+
+def _store_elements(factors: List[int],
+                    choose: int,
+                    multiplier: Union[int, None],
+                    divisor: int,
+                    elements: Union[List[CpsElement], CompactElements]) -> None:
+    """
+    Store the sorted elements of a CPS transposition in the persistent cache, as
+    columns of factor indexes, combination ranks (without a multiplier),
+    products and ratios.
+    """
+    index = {f: i for i, f in enumerate(factors)}
+    if len(index) != len(factors):
+        return
+
+    if isinstance(elements, CompactElements):
+        table = (elements._indices, elements.ranks,
+                 elements.prod_nums, elements.prod_dens, elements.nums, elements.dens)
+    else:
+        indices = array(_index_typecode(factors))
+        ranks = []
+        for elm in elements:
+            elm_factors = list(elm.factors)
+            if multiplier:
+                elm_factors.remove(multiplier)
+            combo = sorted(index[f] for f in elm_factors)
+            indices.extend(combo)
+            ranks.append(combination_rank(combo, len(factors)))
+        table = (indices, None if multiplier else _column(ranks),
+                 _column(elm._product[0] for elm in elements),
+                 _column(elm._product[1] for elm in elements),
+                 _column(elm._num for elm in elements),
+                 _column(elm._den for elm in elements))
+
+    _cache.put(_cache_key(factors, choose, multiplier, divisor), tuple(_pack(column) for column in table))
+
+
+def sort_elements(elms: List[CpsElement]) -> List[CpsElement]:
+    """
+    Sort CPS elements by ratio, using exact integer keys scaled to a common
+    denominator rather than pairwise comparisons.
+    """
+    with _timer("sort"):
+        denominator = 1
+        for elm in elms:
+            den = elm._den
+            if denominator % den:
+                denominator = denominator // math.gcd(denominator, den) * den
+        return sorted(elms, key=lambda elm: elm.sort_key(denominator))
+
+
+def _column(values: Iterable[int], typecode: str = 'q') -> Union[array, List[int]]:
+    """
+    Pack ints into a typed array, or into a list if any of them doesn't fit.
+    """
+    values = values if isinstance(values, list) else list(values)
+    try:
+        return array(typecode, values)
+    except OverflowError:
+        return values
+
+
+class CompactElement(CpsElement):
+    """
+    Flyweight view of one element of a CompactElements table. Views are created
+    on access, hold only the table and a position in it, and can't be modified.
+    """
+    __slots__ = ('_table', '_i')
+
+    def __init__(self, table: CompactElements, i: int):
+        self._table = table
+        self._i = i
+
+    @property
+    def _factors(self) -> Tuple[int, ...]:
+        return self._table.factors_at(self._i)
+
+    @property
+    def _size(self) -> int:
+        return self._table.width(self._i)
+
+    @property
+    def _multiplier(self) -> int:
+        return self._table.multiplier or 0
+
+    @property
+    def _orig_product(self) -> int:
+        return reduce(mul, self._factors, 1)
+
+    @property
+    def _product(self) -> Tuple[int, int]:
+        return self._table.prod_nums[self._i], self._table.prod_dens[self._i]
+
+    @property
+    def _num(self) -> int:
+        return self._table.nums[self._i]
+
+    @property
+    def _den(self) -> int:
+        return self._table.dens[self._i]
+
+    @property
+    def _rank(self) -> Union[int, None]:
+        ranks = self._table.ranks
+        return ranks[self._i] if ranks is not None else None
+
+    @property
+    def ratio_n(self) -> Ratio:
+        return Ratio(self._num, self._den)
+
+    def div(self, divisor: int) -> CpsElement:
+        raise ValueError("Elements of a compact CPS can't be modified, use transposed() instead")
+
+
+class CompactElements(object):
+    """
+    Sorted elements of a CPS held in contiguous typed arrays rather than as one
+    object per element: the indexes of each element's factors in the factor
+    list, its combination rank (without a multiplier), and the numerators and
+    denominators of its product and reduced ratio. Columns with a value that
+    doesn't fit in 64 bits are kept as lists of ints.
+
+    Elements normally all have choose factors. For tables built by from_combos()
+    choose is None, elements can have any number of (possibly repeated) factors,
+    and an offsets array marks where each element's factor indexes start.
+
+    Indexing and iteration return CompactElement views.
+    """
+    def __init__(self,
+                 factors: Sequence[int],
+                 choose: Union[int, None],
+                 multiplier: Union[int, None],
+                 indices: array,
+                 ranks: Union[array, List[int], None],
+                 prod_nums: Union[array, List[int]],
+                 prod_dens: Union[array, List[int]],
+                 nums: Union[array, List[int]],
+                 dens: Union[array, List[int]],
+                 offsets: array = None):
+        self._factors = tuple(factors)
+        self._choose = choose
+        self._multiplier = multiplier
+        self._indices = indices
+        self._ranks = ranks
+        self._prod_nums = prod_nums
+        self._prod_dens = prod_dens
+        self._nums = nums
+        self._dens = dens
+        self._offsets = offsets
+
+    @classmethod
+    def build(cls,
+              factors: Sequence[int],
+              choose: int,
+              multiplier: Union[int, None] = None,
+              divisor: int = 1) -> CompactElements:
+        """
+        Compute and sort the elements of a CPS transposition directly into arrays.
+        """
+        n = len(factors)
+        combos = list(combinations(range(n), choose))
+        prods = [reduce(mul, (factors[i] for i in combo), multiplier or 1) for combo in combos]
+        return cls._sorted(factors, choose, multiplier, combos, range(len(combos)), prods, divisor)
+
+    @classmethod
+    def from_combos(cls,
+                    factors: Sequence[int],
+                    combos: Iterable[Tuple[int, ...]],
+                    divisor: int = 1) -> CompactElements:
+        """
+        Compute and sort elements given as tuples of indexes into factors, of any
+        length and possibly with repeats, e.g. (0, 0, 2) for factors[0]**2 * factors[2].
+        """
+        combos = list(combos)
+        prods = [reduce(mul, (factors[i] for i in combo), 1) for combo in combos]
+        return cls._sorted(factors, None, None, combos, None, prods, divisor)
+
+    @classmethod
+    def _sorted(cls,
+                factors: Sequence[int],
+                choose: Union[int, None],
+                multiplier: Union[int, None],
+                combos: Sequence[Tuple[int, ...]],
+                ranks: Union[Sequence[int], None],
+                prods: Sequence[int],
+                divisor: int) -> CompactElements:
+        products = [divide_product(prod, divisor) for prod in prods]
+        ratios = [octave_reduce_pair(*product) for product in products]
+        _count("octave_reductions", len(ratios))
+
+        # same exact integer keys as sort_elements()
+        with _timer("sort"):
+            denominator = 1
+            for _, den in ratios:
+                if denominator % den:
+                    denominator = denominator // math.gcd(denominator, den) * den
+            order = sorted(range(len(ratios)), key=lambda i: ratios[i][0] * (denominator // ratios[i][1]))
+
+        offsets = None
+        if choose is None:
+            offsets = array('L', [0])
+            for i in order:
+                offsets.append(offsets[-1] + len(combos[i]))
+
+        return cls(factors, choose, multiplier,
+                   cls._index_column(factors, (combos[i] for i in order)),
+                   None if multiplier or ranks is None else _column(ranks[i] for i in order),
+                   _column(products[i][0] for i in order),
+                   _column(products[i][1] for i in order),
+                   _column(ratios[i][0] for i in order),
+                   _column(ratios[i][1] for i in order),
+                   offsets)
+
+    @staticmethod
+    def _index_column(factors: Sequence[int], combos: Iterable[Tuple[int, ...]]) -> array:
+        indices = array(_index_typecode(factors))
+        for combo in combos:
+            indices.extend(combo)
+        return indices
+
+    @property
+    def factors(self) -> Tuple[int, ...]:
+        return self._factors
+
+    @property
+    def choose(self) -> int:
+        return self._choose
+
+    @property
+    def multiplier(self) -> Union[int, None]:
+        return self._multiplier
+
+    @property
+    def ranks(self) -> Union[array, List[int], None]:
+        return self._ranks
+
+    @property
+    def prod_nums(self) -> Union[array, List[int]]:
+        return self._prod_nums
+
+    @property
+    def prod_dens(self) -> Union[array, List[int]]:
+        return self._prod_dens
+
+    @property
+    def nums(self) -> Union[array, List[int]]:
+        return self._nums
+
+    @property
+    def dens(self) -> Union[array, List[int]]:
+        return self._dens
+
+    def width(self, i: int) -> int:
+        """
+        Number of factors of element i, not counting the multiplier.
+        """
+        if self._offsets is not None:
+            return self._offsets[i + 1] - self._offsets[i]
+        return self._choose
+
+    def _combo(self, i: int) -> Tuple[int, ...]:
+        if self._offsets is not None:
+            return tuple(self._indices[self._offsets[i]:self._offsets[i + 1]])
+        start = i * self._choose
+        return tuple(self._indices[start:start + self._choose])
+
+    def factors_at(self, i: int) -> Tuple[int, ...]:
+        factors = [self._factors[j] for j in self._combo(i)]
+        if self._multiplier:
+            factors.append(self._multiplier)
+        return tuple(sorted(factors))
+
+    def transposed(self, divisor: int) -> CompactElements:
+        """
+        The same elements divided by divisor, and re-sorted.
+        """
+        combos = [self._combo(i) for i in range(len(self))]
+        prods = [reduce(mul, (self._factors[j] for j in combo), self._multiplier or 1) for combo in combos]
+        ranks = self._ranks
+        if ranks is None and self._choose is not None:
+            ranks = range(len(combos))
+        return self._sorted(self._factors, self._choose, self._multiplier, combos, ranks, prods, divisor)
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the arrays, in bytes.
+        """
+        columns = [self._indices, self._ranks, self._prod_nums, self._prod_dens, self._nums, self._dens,
+                   self._offsets]
+        return sum(c.itemsize * len(c) if isinstance(c, array) else 8 * len(c) + sum(sys.getsizeof(v) for v in c)
+                   for c in columns if c is not None)
+
+    def __len__(self) -> int:
+        return len(self._nums)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[CompactElement, List[CompactElement]]:
+        if isinstance(i, slice):
+            return [CompactElement(self, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("element index out of range")
+        return CompactElement(self, i)
+
+    def __iter__(self) -> Iterator[CompactElement]:
+        for i in range(len(self)):
+            yield CompactElement(self, i)
+
+
 class CPS(object):
     """
     Describes an arbitrary CPS, given a list of factors and a size. Optional multipler
     for a CPS which is embedded within a larger CPS (e.g., a hexany within an eikosany).
+
+    With compact=True the elements are kept in typed arrays (see CompactElements)
+    instead of as CpsElement objects, which takes much less memory for large sets.
+
+    A CPS is not modified after it is created; transpose() returns a new, cached view
+    that shares the factors, name and parent of the CPS it was created from.
     """
     def __init__(self,
                  factors: List[int],
                  choose: int = None,
                  multiplier: int = None,
                  name: str = None,
-                 parent: CPS = None):
+                 parent: CPS = None,
+                 compact: bool = False):
         if not factors:
             raise ValueError("No factors specified")
 
+        if not choose:
+            choose = int(len(factors)/2)
+
+        with _timer("init"):
+            elements = _load_elements(factors, choose, multiplier, 1, compact) if _cache is not None else None
+            if elements is None and compact:
+                elements = CompactElements.build(factors, choose, multiplier)
+                _count("elements_built", len(elements))
+                if _cache is not None:
+                    _store_elements(factors, choose, multiplier, 1, elements)
+            elif elements is None:
+                elements = []
+                for rank, combo in enumerate(combinations(factors, choose)):
+                    elm = CpsElement(combo, multiplier=multiplier)
+                    if not multiplier:
+                        elm._rank = rank
+                    elements.append(elm)
+                _count("elements_built", len(elements))
+                _count("octave_reductions", len(elements))
+                elements = sort_elements(elements)
+                if _cache is not None:
+                    _store_elements(factors, choose, multiplier, 1, elements)
+
+        self._setup(factors, choose, elements, multiplier, name, parent, (1, "1"))
+
+    @classmethod
+    def from_elements(cls,
+                      factors: List[int],
+                      elements: List[CpsElement],
+                      multiplier: int = None,
+                      name: str = None,
+                      parent: CPS = None,
+                      transposition: Tuple[int, str] = None,
+                      relative_index: List[int] = None,
+                      choose: int = None) -> CPS:
+        """
+        Create a CPS from a list of elements that are already transposed and
+        sorted, without recomputing them. For an embedded CPS the positions of
+        the elements in the parent can be passed as relative_index, if known.
+
+        choose defaults to the number of factors of the first element; elements
+        of a CompactElements table with no fixed choose value (see
+        CompactElements.from_combos()) give a CPS whose choose is None.
+        """
+        if not isinstance(elements, CompactElements):
+            elements = list(elements)
+            if choose is None:
+                choose = len(elements[0].factors) - (1 if multiplier else 0) if elements else 0
+        elif choose is None:
+            choose = elements.choose
+        cps = cls.__new__(cls)
+        cps._setup(factors, choose, elements, multiplier, name, parent, transposition or (1, "1"), relative_index)
+        return cps
+
+    def _setup(self,
+               factors: List[int],
+               choose: int,
+               elements: List[CpsElement],
+               multiplier: Union[int, None],
+               name: Union[str, None],
+               parent: Union[CPS, None],
+               transposition: Tuple[int, str],
+               relative_index: List[int] = None) -> None:
         self._factors = factors
         self._factors_str = [str(f) for f in factors]
+        self._choose = choose
         self._multiplier = multiplier
 
+        # factor value -> index, for ranking combinations given by value
+        self._factor_index = {f: i for i, f in enumerate(factors)}
+        if len(self._factor_index) != len(factors):
+            self._factor_index = None
+
         self._product = reduce(mul, self._factors, 1)
 
         self._name = name if name else f"unamed {'-'.join(self._factors_str)}"
-        self._transposition = 1
-        self._transposition_str = "1"
+        self._transposition, self._transposition_str = transposition
+
+        # transposed views share the cache of the CPS they were created from
+        self._base = self
+        self._transpositions = OrderedDict()
+        self._transpositions_lock = Lock()
 
-        self._map = None
         self._parent = parent
-        self._relative_map = None
-        self._relative_index = None
+        self._relative_index = relative_index
 
-        if not choose:
-            choose = int(len(factors)/2)
-        self._cps = sorted([CpsElement(combo, multiplier=self._multiplier)
-                            for combo in combinations(factors, choose)])
+        self._cps = elements
         self._size = len(self._cps)
-        self._build_maps()
+        self._reset_derived()
+
+    def _reset_derived(self) -> None:
+        # structures derived from the elements are computed on first access,
+        # and are discarded when a transposed view is made
+        self._map = None
+        self._o_C_map = None
+        self._relative_map = None
+        self._mask = None
+        self._tone_index = None
+        self._tone_ids = {}
+        self._positions = None
+        self._products = None
+        self._ratios = None
+        self._pitches = None
+        self._notes = {}
+        self._formatted = {}
 
     @property
     def name(self) -> str:
@@ -135,6 +890,10 @@ class CPS(object):
     def factors(self) -> List[int]:
         return self._factors
 
+    @property
+    def choose(self) -> int:
+        return self._choose
+
     @property
     def product(self) -> int:
         return self._product
@@ -143,6 +902,10 @@ class CPS(object):
     def transposition(self) -> str:
         return self._transposition_str
 
+    @property
+    def transposition_n(self) -> int:
+        return self._transposition
+
     @property
     def multiplier(self) -> int:
         return self._multiplier
@@ -151,29 +914,142 @@ class CPS(object):
     def parent(self) -> Union[CPS, None]:
         return self._parent
 
+    @property
+    def compact(self) -> bool:
+        return isinstance(self._cps, CompactElements)
+
     @property
     def map(self) -> Dict[str, int]:
+        if self._map is None:
+            _count("map_builds")
+            self._map = {
+                str(elm.factors): i
+                for i, elm, in enumerate(self._cps)
+            }
         return self._map
 
+    @property
+    def o_C_map(self) -> Dict[int, int]:
+        if self._o_C_map is None:
+            _count("map_builds")
+            self._o_C_map = {
+                n: i for i, n in enumerate(self.o_C_notes)
+            }
+        return self._o_C_map
+
     @property
     def relative_map(self) -> Dict[str, int]:
+        if self._relative_map is None and self.relative_index is not None:
+            _count("map_builds")
+            self._relative_map = {
+                str(elm.factors): i
+                for elm, i in zip(self._cps, self._relative_index)
+            }
         return self._relative_map
 
     @property
     def relative_index(self) -> Union[List[int], None]:
+        """
+        Position in the parent of each element, for an embedded CPS.
+        """
+        if self._relative_index is None and self._parent:
+            parent = self._parent
+            positions = parent._element_positions()
+            _count("map_builds")
+            with _timer("relative_index"):
+                if positions is not None:
+                    self._relative_index = [positions[parent.rank_of(elm.factors)] for elm in self._cps]
+                else:
+                    # elements that can't be ranked are looked up by their factors
+                    try:
+                        self._relative_index = [parent.map[str(elm.factors)] for elm in self._cps]
+                    except KeyError:
+                        raise ValueError(f"Can't locate the elements of {self._name} in {parent.name}")
         return self._relative_index
 
+    @property
+    def elements(self) -> List[CpsElement]:
+        return self._cps
+
+    def _positions_by_tone(self, divisor: int) -> List[int]:
+        """
+        For each element, the position of the first element with the same
+        product when transposed by divisor. With composite factors different
+        elements can be the same tone (e.g. 3*15*7 and 5*9*7 in a CPS of
+        1, 3, 5, 7, 9, 15), and they then map to the same position.
+        """
+        ids = self._tone_ids.get(divisor)
+        if ids is None:
+            first = {}
+            if divisor == self._transposition:
+                products = (elm._product for elm in self._cps)
+            else:
+                products = (divide_product(elm._orig_product, divisor) for elm in self._cps)
+            ids = [first.setdefault(product, i) for i, product in enumerate(products)]
+            self._tone_ids[divisor] = ids
+        return ids
+
+    @property
+    def tone_index(self) -> Union[List[int], None]:
+        """
+        For an embedded CPS, the position in the parent of each element's tone:
+        its relative index, except that elements holding the same tone (in
+        this CPS's transposition) share the position of the first of them.
+        """
+        if self._tone_index is None and self.relative_index is not None:
+            ids = self._parent._positions_by_tone(self._transposition)
+            self._tone_index = [ids[i] for i in self._relative_index]
+        return self._tone_index
+
+    @property
+    def mask(self) -> Union[int, None]:
+        """
+        Bitmask of the tones of this CPS in its parent, with bit i set for each
+        position i in tone_index, so that the popcount of the AND of the masks
+        of two CPS in the same parent and transposition is their number of
+        common tones.
+        """
+        if self._mask is None and self.tone_index is not None:
+            self._mask = sum(1 << i for i in set(self._tone_index))
+        return self._mask
+
     @property
     def products(self) -> Set[str]:
-        return {str(elm.product) for elm in self._cps}
+        if self._products is None:
+            self._products = {str(elm.product) for elm in self._cps}
+        return self._products
 
     @property
     def ratios(self) -> List[Ratio]:
-        return [elm.ratio_n for elm in self._cps]
+        if self._ratios is None:
+            self._ratios = [elm.ratio_n for elm in self._cps]
+        return self._ratios
+
+    @property
+    def pitches(self) -> List[float]:
+        """
+        Pitch of each element in octaves above the 1/1 (from 0 up to 1 for 2/1),
+        computed once from the exact reduced ratio and cached.
+        """
+        if self._pitches is None:
+            self._pitches = [pitch(elm._num, elm._den) for elm in self._cps]
+        return self._pitches
+
+    def notes(self, resolution: int = O_C_RESOLUTION) -> List[int]:
+        """
+        Each element as a step of an equal division of the octave into resolution
+        steps, e.g. 1200 for cents or 1536 (the default) for o_C note values.
+        The result is cached per resolution.
+        """
+        notes = self._notes.get(resolution)
+        if notes is None:
+            _count("notes_builds")
+            notes = self._notes[resolution] = [round(resolution * p) for p in self.pitches]
+        return notes
 
     @property
     def o_C_notes(self) -> List[int]:
-        return [elm.o_C_note for elm in self._cps]
+        return self.notes(O_C_RESOLUTION)
 
     def __str__(self) -> str:
         lines = []
@@ -183,42 +1059,130 @@ class CPS(object):
             lines.append(str(elm))
         return '\n'.join(lines)
 
-    def transpose(self, expr: int, expr_str: str) -> None:
-        self._transposition = expr
-        self._transposition_str = expr_str
+    def transpose(self, expr: Union[int, str], expr_str: str = None) -> CPS:
+        """
+        Return a view of this CPS with the element whose product is expr as the 1/1.
+        expr can also be given as a string such as "1*3*5", which is then used as
+        expr_str. Transpositions are relative to the original products, not to the
+        current transposition, and are cached per (expr, expr_str).
+        """
+        if isinstance(expr, str):
+            expr, expr_str = parse_transposition(expr)
+        elif expr_str is None:
+            expr_str = str(expr)
+        base = self._base
+        key = (expr, expr_str)
+        with base._transpositions_lock:
+            view = base._transpositions.get(key)
+            if view is not None:
+                base._transpositions.move_to_end(key)
+                _count("transposition_cache_hits")
+                return view
+        _count("transposition_cache_misses")
 
-        transposed = []
-        for elm in self._cps:
-            transposed.append(elm.div(expr))
-        self._cps = sorted(transposed)
+        with _timer("transpose"):
+            view = base._transposed(expr, expr_str)
+
+        with base._transpositions_lock:
+            view = base._transpositions.setdefault(key, view)
+            base._transpositions.move_to_end(key)
+            while len(base._transpositions) > TRANSPOSITION_CACHE_SIZE:
+                base._transpositions.popitem(last=False)
+        return view
+
+    def _transposed(self, expr: int, expr_str: str) -> CPS:
+        view = copy(self)
+        view._transposition = expr
+        view._transposition_str = expr_str
+        view._cps = None
+        compact = isinstance(self._cps, CompactElements)
+        # sets without a single choose value aren't kept in the persistent cache
+        cached = _cache is not None and self._choose is not None
+        if cached:
+            view._cps = _load_elements(self._factors, self._choose, self._multiplier, expr, compact)
+        if view._cps is None:
+            if compact:
+                view._cps = self._cps.transposed(expr)
+            else:
+                view._cps = sort_elements([elm.transposed(expr) for elm in self._cps])
+                _count("octave_reductions", self._size)
+            _count("elements_built", self._size)
+            if cached:
+                _store_elements(self._factors, self._choose, self._multiplier, expr, view._cps)
+        view._relative_index = None
+        view._reset_derived()
+        return view
+
+    def _formatted_ratios(self, padded: bool) -> List[str]:
+        """
+        The ratio of each element as a string, padded to a column width of 9 if
+        padded, computed once per CPS (and transposition).
+        """
+        cells = self._formatted.get(padded)
+        if cells is None:
+            if padded:
+                cells = [f"{elm.ratio:<9}" for elm in self._cps]
+            else:
+                cells = [elm.ratio for elm in self._cps]
+            self._formatted[padded] = cells
+        return cells
+
+    def _scale_segments(self, tabular: bool, simple: bool, csv: bool) -> Tuple[str, List[str], str]:
+        """
+        The text of list_scale() as a separator, segments to join with it and
+        a tail. A CPS with a parent is laid out in the parent's columns as runs
+        of blank cells, each ending in one of its own cells, so the work done
+        and the memory used depend on the size of this CPS rather than of the
+        parent. Computed once per CPS (and transposition).
+        """
+        sep = (',' if csv else ' ') if tabular else (', ' if csv else ' ')
+        if not (tabular and self._parent):
+            return sep, self._formatted_ratios(tabular and not csv), ""
 
-        self._build_maps()
+        key = (simple, csv)
+        layout = self._formatted.get(key)
+        if layout is None:
+            # in the parent's transposition this CPS's elements are the
+            # parent's own elements, already formatted
+            parent = self._parent
+            if self._transposition == parent._transposition:
+                cells = parent._formatted_ratios(not csv)
+                filled = [(i, cells[i]) for i in sorted(self.relative_index)]
+            else:
+                filled = sorted(zip(self.relative_index, self._formatted_ratios(not csv)))
+            blank = "" if csv else "        " if simple else ".        "
+            before = blank + sep
+            segments = []
+            pos = 0
+            for i, cell in filled:
+                segments.append(before * (i - pos) + cell)
+                pos = i + 1
+            layout = segments, (sep + blank) * (parent.size - pos)
+            self._formatted[key] = layout
+        return (sep,) + layout
 
     def list_scale(self,
                    tabular: bool = False,
                    simple: bool = False,
                    csv: bool = False) -> str:
-        if tabular:
-            if self._parent:
-                sep = ',' if csv else ' '
-                blank = "" if csv else "        " if simple else ".        "
-                ref = list(repeat(blank, self._parent.size))
-                for pos, i in enumerate(self.relative_index):
-                    ref[i] = f"{self._cps[pos].ratio}" if csv else f"{self._cps[pos].ratio:<9}"
-                scl = sep.join(ref)
-            else:
-                sep = ',' if csv else ' '
-                if csv:
-                    scale = [f"{elm.ratio}" for elm in self._cps]
-                else:
-                    scale = [f"{elm.ratio:<9}" for elm in self._cps]
-                scl = sep.join(scale)
-        else:
-            scale = [elm.ratio for elm in self._cps]
+        with _timer("list_scale"):
             # scl = f"{self._name}: {'-'.join(self._factors_str)} @ {self._transposition_str}: {' '.join(scale)}"
-            sep = ', ' if csv else ' '
-            scl = sep.join(scale)
-        return scl
+            sep, segments, tail = self._scale_segments(tabular, simple, csv)
+            return sep.join(segments) + tail
+
+    def write_scale(self,
+                    out: IO[str],
+                    tabular: bool = False,
+                    simple: bool = False,
+                    csv: bool = False) -> None:
+        """
+        Write the same text as list_scale() to out, with the trailing blank
+        columns written separately instead of being copied into one string.
+        """
+        with _timer("list_scale"):
+            sep, segments, tail = self._scale_segments(tabular, simple, csv)
+            out.write(sep.join(segments))
+            out.write(tail)
 
     def list_factors(self, stars: bool = False) -> str:
         if stars:
@@ -231,22 +1195,106 @@ class CPS(object):
                           size: int,
                           choose: int,
                           transpose: Tuple[int, str] = None) -> List[CPS]:
-        factors = set(self.factors)
-        embeds = list(combinations(self.factors, size))
-        cps_list = []
+        return list(self.iter_embedded_cps(size, choose, transpose=transpose))
+
+    def iter_embedded_cps(self,
+                          size: int,
+                          choose: int,
+                          transpose: Tuple[int, str] = None) -> Iterator[CPS]:
+        """
+        Generate the CPS instances of the given size and choose value embedded in
+        this one, each with one of the remaining factors as its multiplier, in the
+        same order as find_embedded_cps().
+
+        The elements of each embedded CPS are looked up in this CPS by combination
+        rank. When the embedded CPS is transposed the same way as this one they
+        are the very same elements, so nothing is recomputed or re-sorted. A CPS
+        whose elements can't be ranked (e.g. with repeated factors) builds each
+        embedded CPS from its factors instead.
+        """
+        if choose + 1 != self._choose:
+            raise ValueError(f"A {size} choose {choose} CPS with a multiplier is not embedded in "
+                             f"a {len(self._factors)} choose {self._choose} CPS")
+        parent_positions = self._element_positions()
+        if parent_positions is None:
+            yield from self._iter_embedded_by_factors(size, choose, transpose)
+            return
 
-        for embed in embeds:
-            embed = set(embed)
-            mults = sorted(factors.difference(embed))
+        n = len(self._factors)
+        divisor = transpose[0] if transpose else 1
+        shared = divisor == self._transposition
+
+        for embed in combinations(range(n), size):
+            embed = sorted(embed, key=lambda i: self._factors[i])
+            mults = sorted(set(range(n)).difference(embed), key=lambda i: self._factors[i])
             for mult in mults:
-                embed = sorted(embed)
-                name = f"{embed}*{mult}"
-                cps = CPS(embed, multiplier=mult, choose=choose, name=name, parent=self)
-                if transpose:
-                    cps.transpose(transpose[0], transpose[1])
-                cps_list.append(cps)
+                # checked once per CPS rather than through _timer(), as this loop is hot
+                stats = _stats
+                if stats is not None:
+                    start = time.perf_counter()
+
+                positions = [parent_positions[combination_rank(sorted(combo + (mult,)), n)]
+                             for combo in combinations(embed, choose)]
+                if shared:
+                    positions.sort()
+                    elements = [self._cps[pos] for pos in positions]
+                else:
+                    elements = sort_elements([self._cps[pos].transposed(divisor) for pos in positions])
+                    positions = None
 
-        return cps_list
+                factors = [self._factors[i] for i in embed]
+                cps = CPS.from_elements(factors,
+                                        elements,
+                                        multiplier=self._factors[mult],
+                                        name=f"{factors}*{self._factors[mult]}",
+                                        parent=self,
+                                        transposition=transpose,
+                                        relative_index=positions)
+                if stats is not None:
+                    stats.add_time("embedded", start)
+                    stats.count("embedded_cps")
+                    if not shared:
+                        stats.count("elements_built", len(elements))
+                        stats.count("octave_reductions", len(elements))
+                yield cps
+
+    def _iter_embedded_by_factors(self,
+                                  size: int,
+                                  choose: int,
+                                  transpose: Tuple[int, str] = None) -> Iterator[CPS]:
+        """
+        iter_embedded_cps() for a CPS whose elements can't be ranked: each
+        embedded CPS is built from the distinct factors of a combination of this
+        CPS's factors, with each remaining distinct factor as its multiplier,
+        and is located in this CPS by the factors of its elements (see map).
+        """
+        distinct = set(self._factors)
+        for embed in combinations(self._factors, size):
+            embed = sorted(set(embed))
+            for mult in sorted(distinct.difference(embed)):
+                cps = CPS(embed, multiplier=mult, choose=choose, name=f"{embed}*{mult}", parent=self)
+                yield cps.transpose(*transpose) if transpose else cps
+
+    def rank_of(self, factors: Sequence[int]) -> int:
+        """
+        Combination rank (see combination_rank()) of the element of this CPS with
+        the given factors.
+        """
+        if self._factor_index is None or len(factors) != self._choose:
+            raise ValueError(f"{factors} is not an element of {self._name}")
+        try:
+            indices = sorted(self._factor_index[f] for f in factors)
+        except KeyError:
+            raise ValueError(f"{factors} is not an element of {self._name}")
+        return combination_rank(indices, len(self._factors))
+
+    @staticmethod
+    def stats() -> Union[Stats, None]:
+        """
+        The counters and timers being recorded, or None if profiling is off
+        (see profile() and set_stats()).
+        """
+        return _stats
 
     @classmethod
     def find_common_tones(cls,
@@ -260,42 +1308,53 @@ class CPS(object):
         Returns a dict where the key is the number of common tones, and the value is
         a list of the CPS instances that meet that criterion.
         """
-        product_sets = []
-        for cps in cps_list:
-            product_sets.append(cps.products)
+        if index is None:
+            index = 0
+        with _timer("common_tones"):
+            return cls._find_common_tones(cps_list, index)
 
-        # analyze the first one
-        ps = product_sets[0]
+    @classmethod
+    def _find_common_tones(cls, cps_list: List[CPS], index: int) -> Dict[int, List[CPS]]:
+        selected = cps_list[index]
         intersections = {
-            i: [] for i in range(6)
+            i: [] for i in range(max(cps.size for cps in cps_list) + 1)
         }
 
-        for i, other in enumerate(product_sets[1:]):
-            inter = ps.intersection(other)
-            mag = len(inter)
-            intersections[mag].append(i+1)
+        parent = selected.parent
+        if parent and all(cps.parent is parent and cps._transposition == selected._transposition
+                          for cps in cps_list):
+            # same parent and transposition: count shared tones in the parent
+            mask = selected.mask
+            for i, cps in enumerate(cps_list):
+                if i != index:
+                    intersections[popcount(mask & cps.mask)].append(i)
+        else:
+            products = selected.products
+            for i, cps in enumerate(cps_list):
+                if i != index:
+                    intersections[len(products.intersection(cps.products))].append(i)
 
         return {
             k: [cps_list[i] for i in v] for k, v in intersections.items()
         }
 
-    def _build_maps(self):
-        if self._parent:
-            # map factors relative to parent CPS
-            self._relative_map = {
-                str(elm.factors): self._parent.map[str(elm.factors)]
-                for elm in self._cps
-            }
-
-            # list of relative indexes
-            self._relative_index = [self._relative_map[str(elm.factors)] for elm in self._cps]
-
-        # map factors to index values
-        self._map = {
-            str(elm.factors): i
-            for i, elm, in enumerate(self._cps)
-        }
-
-        self._o_C_map = {
-            n: i for i, n in enumerate(self.o_C_notes)
-        }
+    def _element_positions(self) -> Union[List[int], array, None]:
+        """
+        Sorted position of each element, indexed by combination rank, or None if
+        the elements can't be ranked (with a multiplier, repeated factors or no
+        single choose value).
+        """
+        if (self._positions is None and not self._multiplier and self._factor_index is not None
+                and self._choose is not None):
+            _count("map_builds")
+            if isinstance(self._cps, CompactElements):
+                positions = array('q', [0]) * math.comb(len(self._factors), self._choose)
+                for i, rank in enumerate(self._cps.ranks):
+                    positions[rank] = i
+            else:
+                positions = [0] * math.comb(len(self._factors), self._choose)
+                for i, elm in enumerate(self._cps):
+                    rank = elm._rank if elm._rank is not None else self.rank_of(elm.factors)
+                    positions[rank] = i
+            self._positions = positions
+        return self._positions
@@ -0,0 +1,121 @@
+"""
+Persistent on-disk cache of CPS element tables, in a SQLite file.
+
+Entries are keyed by (factors, choose, multiplier, transposition) and hold the
+sorted elements of that transposition as marshalled columns of factor indexes,
+combination ranks, products and ratios (the bytes of typed arrays where the
+values fit), which load without recomputing anything; the maps of a CPS are
+rebuilt from those. The whole cache is invalidated whenever cps.py changes.
+
+Usage:
+    from cps_cache import enable_cache
+    enable_cache("cps_cache.sqlite")
+"""
+
+from __future__ import annotations
+
+import hashlib
+import marshal
+import os
+import sqlite3
+from threading import Lock
+from typing import Tuple, Union
+
+import cps
+
+
+def cps_version() -> str:
+    """
+    Fingerprint of the code that computes element tables (the contents of cps.py)
+    and of the format they are stored in.
+    """
+    with open(cps.__file__, 'rb') as f:
+        digest = hashlib.sha1(f.read())
+    digest.update(str(marshal.version).encode())
+    return digest.hexdigest()
+
+
+class CpsCache(object):
+    """
+    Content-addressed cache of CPS element tables, stored in a SQLite file.
+    """
+    def __init__(self, path: str, version: str = None):
+        self._path = path
+        self._version = version if version else cps_version()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # the cache can always be rebuilt, so trade durability for write speed
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS elements "
+                             "(key TEXT PRIMARY KEY, version TEXT NOT NULL, data BLOB NOT NULL)")
+            # entries computed by any other version of cps.py are stale
+            self._db.execute("DELETE FROM elements WHERE version != ?", (self._version,))
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def version(self) -> str:
+        return self._version
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+
+    @staticmethod
+    def digest(key: Tuple) -> str:
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, key: Tuple) -> Union[Tuple, None]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM elements WHERE key = ? AND version = ?",
+                                   (self.digest(key), self._version)).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return marshal.loads(row[0])
+
+    def put(self, key: Tuple, table: Tuple) -> None:
+        data = marshal.dumps(table)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO elements (key, version, data) VALUES (?, ?, ?)",
+                             (self.digest(key), self._version, data))
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM elements")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def enable_cache(path: str = None) -> CpsCache:
+    """
+    Open (or create) the cache file and use it for every CPS built from now on.
+    The default location can be set with the CPS_CACHE environment variable.
+    """
+    if not path:
+        path = os.environ.get("CPS_CACHE", "cps_cache.sqlite")
+    cache = CpsCache(path)
+    cps.set_cache(cache)
+    return cache
+
+
+def disable_cache() -> None:
+    cps.set_cache(None)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Command-line front end for the CPS reports in cps_functions.py, e.g.
+
+    python cps_cli.py cps -f 1,3,5,7,11,13 -N "1-3-5-7-11-13 Eikosany"
+    python cps_cli.py hexanies -f 1,3,5,7,11,13 -t 1*3*5
+    python cps_cli.py csound -f 1,3,5,7,11,13 > eikosany-hexanies.orc
+
+With --serve the process stays up and answers the same requests over a Unix
+socket (or a local TCP port, given as host:port), keeping the CPS instances it
+has built, and their transpositions, in memory between requests:
+
+    python cps_cli.py --serve /tmp/cps.sock &
+    python cps_cli.py --connect /tmp/cps.sock scale -f 1,3,5,7,11,13 -t 1*5*13
+
+The protocol is one JSON object per line each way: a request holds the same
+fields as the command line (see request_from_args()), and the response holds
+"ok" and either "output" (the text of the report) and "data" (for reports
+that return values, such as "scale") or "error". A request with "profile" set
+also gets back "stats", the library's counters and timers for the report (see
+cps.profile()).
+"""
+
+import argparse
+from contextlib import redirect_stdout
+from functools import lru_cache
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+from threading import Lock
+from typing import Any, Callable, Dict, IO, List, Tuple, Union
+
+from cps import CPS, parse_transposition, profile
+from cps_export import write_csound_include
+from cps_functions import *
+
+
+# number of CPS instances (each with its own cache of transpositions) the
+# server keeps in memory
+CPS_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=CPS_CACHE_SIZE)
+def get_cps(factors: Tuple[int, ...], choose: Union[int, None], name: Union[str, None]) -> CPS:
+    return CPS(list(factors), choose, name=name)
+
+
+def _transposition(request: Dict[str, Any]) -> Union[Tuple[int, str], None]:
+    spec = request.get("transpose")
+    return parse_transposition(spec) if spec else None
+
+
+def _embedded(cps: CPS, request: Dict[str, Any]) -> List[CPS]:
+    tr = _transposition(request)
+    size, choose = request.get("embedded") or (len(cps.factors) - 2, cps.choose - 1)
+    return transpose_and_spawn(cps, tr, size, choose)
+
+
+def _transposed(cps: CPS, request: Dict[str, Any]) -> CPS:
+    tr = _transposition(request)
+    return cps.transpose(*tr) if tr else cps
+
+
+def _report_cps(cps: CPS, request: Dict[str, Any]) -> None:
+    print_cps(_transposed(cps, request))
+
+
+def _report_transpositions(cps: CPS, request: Dict[str, Any]) -> None:
+    print_cps_transpositions(cps, cps.factors, cps.choose)
+
+
+def _report_hexanies(cps: CPS, request: Dict[str, Any]) -> None:
+    print_hexanies(cps, _transposition(request) or (1, "1"), request.get("embedded") or (4, 2))
+
+
+def _report_hexanies_csv(cps: CPS, request: Dict[str, Any]) -> None:
+    print_hexanies_csv(cps, _transposition(request) or (1, "1"), request.get("embedded") or (4, 2))
+
+
+def _report_hexanies2(cps: CPS, request: Dict[str, Any]) -> None:
+    print_hexanies2(_transposed(cps, request))
+
+
+def _report_common_tones(cps: CPS, request: Dict[str, Any]) -> None:
+    print_hexanies_common_tones(_transposed(cps, request), _embedded(cps, request), 0)
+
+
+def _report_collect(cps: CPS, request: Dict[str, Any]) -> None:
+    if not request.get("names"):
+        raise ValueError("No names specified")
+    collect_hexanies(_transposed(cps, request), _embedded(cps, request), request["names"])
+
+
+def _report_paths(cps: CPS, request: Dict[str, Any]) -> None:
+    print_common_tone_paths(_transposed(cps, request), _embedded(cps, request))
+
+
+def _report_classes(cps: CPS, request: Dict[str, Any]) -> None:
+    size, choose = request.get("embedded") or (len(cps.factors) - 2, cps.choose - 1)
+    print_equivalence_classes(cps, size, choose)
+
+
+def _report_csound(cps: CPS, request: Dict[str, Any]) -> None:
+    tr = _transposition(request)
+    embedded = request.get("embedded") or (len(cps.factors) - 2, cps.choose - 1)
+    write_csound_include(sys.stdout, cps, embedded, [tr] if tr else None)
+
+
+def _report_scale(cps: CPS, request: Dict[str, Any]) -> Dict[str, Any]:
+    cps = _transposed(cps, request)
+    print(cps.list_scale())
+    return {
+        "name": cps.name,
+        "transposition": cps.transposition,
+        "factors": [list(elm.factors) for elm in cps.elements],
+        "ratios": [elm.ratio for elm in cps.elements],
+        "o_C_notes": cps.o_C_notes,
+    }
+
+
+# report name -> function printing the report (and optionally returning data)
+REPORTS: Dict[str, Callable[[CPS, Dict[str, Any]], Any]] = {
+    "cps": _report_cps,
+    "transpositions": _report_transpositions,
+    "hexanies": _report_hexanies,
+    "hexanies-csv": _report_hexanies_csv,
+    "hexanies2": _report_hexanies2,
+    "common-tones": _report_common_tones,
+    "collect": _report_collect,
+    "paths": _report_paths,
+    "classes": _report_classes,
+    "csound": _report_csound,
+    "scale": _report_scale,
+}
+
+
+def run_report(request: Dict[str, Any], out: IO[str] = None) -> Any:
+    """
+    Run the report described by request, writing it to out (default: stdout).
+    Returns the report's data, if any.
+    """
+    report = REPORTS.get(request.get("report"))
+    if report is None:
+        raise ValueError(f"Unknown report: {request.get('report')}")
+    if not request.get("factors"):
+        raise ValueError("No factors specified")
+
+    cps = get_cps(tuple(request["factors"]), request.get("choose"), request.get("name"))
+    if out is None:
+        return report(cps, request)
+    with redirect_stdout(out):
+        return report(cps, request)
+
+
+# reports print to (a redirected) stdout, so they run one at a time
+_report_lock = Lock()
+
+
+def handle_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run a request and return its response. Errors of any kind are returned as
+    a response rather than raised, so that every request gets a reply.
+    """
+    out = io.StringIO()
+    stats = None
+    try:
+        with _report_lock:
+            if request.get("profile"):
+                with profile() as stats:
+                    data = run_report(request, out)
+            else:
+                data = run_report(request, out)
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    response = {"ok": True, "output": out.getvalue()}
+    if data is not None:
+        response["data"] = data
+    if stats is not None:
+        response["stats"] = stats.as_dict()
+    return response
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = json.dumps(handle_request(json.loads(line)))
+            except json.JSONDecodeError as e:
+                response = json.dumps({"ok": False, "error": f"Invalid request: {e}"})
+            except Exception as e:
+                # e.g. report data that can't be encoded as JSON
+                response = json.dumps({"ok": False, "error": f"{type(e).__name__}: {e}"})
+            self.wfile.write(response.encode() + b'\n')
+            self.wfile.flush()
+
+
+def _tcp_address(address: str) -> Union[Tuple[str, int], None]:
+    host, sep, port = address.rpartition(':')
+    return (host or "localhost", int(port)) if sep and port.isdigit() else None
+
+
+def serve(address: str) -> None:
+    """
+    Answer requests on a Unix socket at the path address, or on a TCP port if
+    address is host:port. Each connection gets its own thread, and can send
+    any number of requests.
+    """
+    tcp = _tcp_address(address)
+    if tcp:
+        server = socketserver.ThreadingTCPServer(tcp, _RequestHandler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = socketserver.ThreadingUnixStreamServer(address, _RequestHandler)
+    server.daemon_threads = True
+
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if not tcp and os.path.exists(address):
+            os.remove(address)
+
+
+def query(address: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Send one request to a server started with serve(), and return its response.
+    """
+    tcp = _tcp_address(address)
+    sock = socket.create_connection(tcp) if tcp else socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        if not tcp:
+            sock.connect(address)
+        with sock.makefile('rwb') as f:
+            f.write(json.dumps(request).encode() + b'\n')
+            f.flush()
+            return json.loads(f.readline())
+
+
+def int_list(s: str) -> List[int]:
+    return [int(i) for i in s.split(',')]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Print reports about a CPS, or serve them from a long-running process",
+        prog="cps_cli.py"
+    )
+
+    parser.add_argument("report", help="Report to print", nargs='?', choices=list(REPORTS))
+    parser.add_argument("-f", "--factors", help="Comma-separated factors",
+                        action="store", dest="factors", type=int_list, default=None)
+    parser.add_argument("-k", "--choose", help="Number of factors per element (default: half the factors)",
+                        action="store", dest="choose", type=int, default=None)
+    parser.add_argument("-N", "--name", help="Name of the CPS",
+                        action="store", dest="name", default=None)
+    parser.add_argument("-t", "--transpose", help="Element to use as 1/1, e.g. 1*3*5",
+                        action="store", dest="transpose", default=None)
+    parser.add_argument("-e", "--embedded",
+                        help="Size,choose of the embedded CPS to list (default: hexanies in an eikosany, etc.)",
+                        action="store", dest="embedded", type=int_list, default=None)
+    parser.add_argument("--names", help="Embedded CPS to collect, e.g. [1,3,5,7]*11",
+                        action="store", dest="names", nargs='+', default=None)
+    parser.add_argument("--profile", help="Print the library's counters and timers for the report to stderr",
+                        action="store_true", dest="profile", default=False)
+    parser.add_argument("--serve", help="Serve requests on this Unix socket path or host:port",
+                        action="store", dest="serve", default=None)
+    parser.add_argument("--connect", help="Send the request to a server at this Unix socket path or host:port",
+                        action="store", dest="connect", default=None)
+
+    args = parser.parse_args(argv)
+    if not args.serve and not (args.report and args.factors):
+        parser.error("a report and factors are required unless serving")
+    return args
+
+
+def request_from_args(args) -> Dict[str, Any]:
+    return {
+        "report": args.report,
+        "factors": args.factors,
+        "choose": args.choose,
+        "name": args.name,
+        "transpose": args.transpose,
+        "embedded": args.embedded,
+        "names": args.names,
+        "profile": args.profile,
+    }
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    request = request_from_args(args)
+    if args.connect:
+        response = query(args.connect, request)
+        if not response["ok"]:
+            print(response["error"], file=sys.stderr)
+            return 1
+        sys.stdout.write(response["output"])
+        if "data" in response:
+            print(json.dumps(response["data"]))
+        if "stats" in response:
+            print(json.dumps(response["stats"], indent=2), file=sys.stderr)
+        return 0
+
+    try:
+        if args.profile:
+            with profile() as stats:
+                run_report(request)
+            print(stats.report(), file=sys.stderr)
+        else:
+            run_report(request)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
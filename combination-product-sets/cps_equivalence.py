@@ -0,0 +1,156 @@
+"""
+Canonical keys for the scales of CPS instances, and an index that groups
+instances with the same key, so that analysis can run once per group instead
+of once per instance.
+
+Two keys are provided:
+
+* tone_key() is the sorted set of pitch classes (octave-reduced ratios, with
+  2/1 counted as 1/1). Instances with the same tone key sound the same tones,
+  e.g. the same hexany found in two transpositions of an eikosany.
+
+* canonical_key() is the cyclic sequence of steps between consecutive pitch
+  classes, rotated to its smallest form. Instances with the same canonical key
+  are the same scale up to rotation (choice of 1/1), e.g. all the
+  transpositions of a CPS.
+
+Example:
+    index = EquivalenceIndex()
+    for divisor, label in transpositions:
+        index.add_all(eikosany.transpose(divisor, label).iter_embedded_cps(4, 2, (divisor, label)))
+    for cps in index.representatives():
+        ...
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Tuple
+
+from cps import CPS
+
+
+Pair = Tuple[int, int]
+
+
+def pitch_classes(cps: CPS) -> List[Pair]:
+    """
+    The distinct pitch classes of a CPS as sorted num/den pairs in [1, 2).
+    """
+    classes = {(1, 1) if elm._num == 2 * elm._den else (elm._num, elm._den) for elm in cps.elements}
+    return sorted(classes, key=lambda p: p[0] / p[1])
+
+
+def tone_key(cps: CPS) -> Tuple[Pair, ...]:
+    return tuple(pitch_classes(cps))
+
+
+def steps(classes: List[Pair]) -> List[Pair]:
+    """
+    Ratios between consecutive pitch classes, including the step from the last
+    one up to the octave above the first.
+    """
+    result = []
+    for i, (num, den) in enumerate(classes):
+        next_num, next_den = classes[i + 1] if i + 1 < len(classes) else (2 * classes[0][0], classes[0][1])
+        num, den = next_num * den, next_den * num
+        gcd = math.gcd(num, den)
+        result.append((num // gcd, den // gcd))
+    return result
+
+
+def least_rotation(seq: List) -> int:
+    """
+    Index of the lexicographically smallest rotation of seq (Booth's algorithm,
+    linear in the length of seq).
+    """
+    doubled = seq + seq
+    failure = [-1] * len(doubled)
+    k = 0
+    for j in range(1, len(doubled)):
+        s = doubled[j]
+        i = failure[j - k - 1]
+        while i != -1 and s != doubled[k + i + 1]:
+            if s < doubled[k + i + 1]:
+                k = j - i - 1
+            i = failure[i]
+        if s != doubled[k + i + 1]:
+            if s < doubled[k]:
+                k = j
+            failure[j - k] = -1
+        else:
+            failure[j - k] = i + 1
+    return k
+
+
+def canonical_key(cps: CPS) -> Tuple[Pair, ...]:
+    seq = steps(pitch_classes(cps))
+    k = least_rotation(seq)
+    return tuple(seq[k:] + seq[:k])
+
+
+def digest(key: Tuple) -> str:
+    """
+    Short, stable hash of a key, e.g. for storing it in a file.
+    """
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class EquivalenceIndex(object):
+    """
+    Groups CPS instances by key (canonical_key() by default, i.e. equal up to
+    rotation), keeping every instance, in the order added, under its key.
+    """
+    def __init__(self, key: Callable[[CPS], Hashable] = canonical_key):
+        self._key = key
+        self._classes: Dict[Hashable, List[CPS]] = {}
+        self._count = 0
+
+    def add(self, cps: CPS) -> Hashable:
+        """
+        Add an instance, and return its key.
+        """
+        key = self._key(cps)
+        self._classes.setdefault(key, []).append(cps)
+        self._count += 1
+        return key
+
+    def add_all(self, cps_iter: Iterable[CPS]) -> None:
+        for cps in cps_iter:
+            self.add(cps)
+
+    def __len__(self) -> int:
+        """
+        Number of equivalence classes.
+        """
+        return len(self._classes)
+
+    @property
+    def count(self) -> int:
+        """
+        Number of instances added.
+        """
+        return self._count
+
+    def __contains__(self, cps: CPS) -> bool:
+        return self._key(cps) in self._classes
+
+    def members(self, key: Hashable) -> List[CPS]:
+        return self._classes.get(key, [])
+
+    def equivalents(self, cps: CPS) -> List[CPS]:
+        """
+        All instances added so far that are equivalent to cps.
+        """
+        return self.members(self._key(cps))
+
+    def classes(self) -> Iterator[Tuple[Hashable, List[CPS]]]:
+        return iter(self._classes.items())
+
+    def representatives(self) -> Iterator[CPS]:
+        """
+        The first instance added of each class.
+        """
+        for members in self._classes.values():
+            yield members[0]
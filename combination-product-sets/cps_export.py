@@ -0,0 +1,230 @@
+"""
+Exporters that write CPS instances to files: Scala scale (.scl) and keyboard
+mapping (.kbm) files, CSV tables like hexanies.csv, frequency tables like
+freqs.txt, Csound GEN51 table definitions, and Csound include files with a
+table for every embedded CPS in every transposition.
+
+The writers that handle many CPS instances take any iterable, e.g. the
+generator returned by CPS.iter_embedded_cps(), and write each one to the file
+handle as it arrives, so memory use does not grow with the number of instances.
+"""
+
+from __future__ import annotations
+
+from functools import reduce
+from operator import mul
+from typing import IO, Iterable, List, Tuple, Union
+
+from cps import CPS, O_C_RESOLUTION
+
+
+# buffer size used by open_export()
+EXPORT_BUFFER_SIZE = 1 << 16
+
+# default reference pitch, as used in the GEN51 tables in scratch.py
+BASE_FREQ = 297.989
+BASE_KEY = 60
+
+
+def open_export(path: str) -> IO[str]:
+    """
+    Open a file for export with a large write buffer.
+    """
+    return open(path, 'w', buffering=EXPORT_BUFFER_SIZE)
+
+
+def csv_name(cps: CPS) -> str:
+    """
+    Name of an embedded CPS as used in the first column of hexanies.csv,
+    e.g. "[1-3-5-7]*11".
+    """
+    return cps.name.replace(" ", "").replace(",", "-")
+
+
+def write_scl(f: IO[str], cps: CPS, description: str = None) -> None:
+    """
+    Write a CPS as a Scala scale file. The 1/1 is implicit in the format, so
+    it is left out, and 2/1 is added as the last degree.
+    """
+    degrees = [elm.ratio for elm in cps.elements if elm.ratio not in ('1/1', '2')]
+    degrees.append('2/1')
+
+    f.write(f"! {csv_name(cps)}.scl\n")
+    f.write("!\n")
+    f.write(f"{description if description else f'{cps.name}, 1/1 = {cps.transposition}'}\n")
+    f.write(f" {len(degrees)}\n")
+    f.write("!\n")
+    for degree in degrees:
+        f.write(f" {degree}\n")
+
+
+def write_kbm(f: IO[str],
+              cps: CPS,
+              base_freq: float = BASE_FREQ,
+              base_key: int = BASE_KEY) -> None:
+    """
+    Write a Scala keyboard mapping that maps consecutive keys to consecutive
+    degrees of the scale written by write_scl(), with base_key at the 1/1.
+    """
+    size = len([elm for elm in cps.elements if elm.ratio not in ('1/1', '2')]) + 1
+
+    f.write(f"! {csv_name(cps)}.kbm\n")
+    f.write("! Size of map:\n")
+    f.write(f"{size}\n")
+    f.write("! First MIDI note number to retune:\n")
+    f.write("0\n")
+    f.write("! Last MIDI note number to retune:\n")
+    f.write("127\n")
+    f.write("! Middle note where the first entry of the mapping is mapped to:\n")
+    f.write(f"{base_key}\n")
+    f.write("! Reference note for which frequency is given:\n")
+    f.write(f"{base_key}\n")
+    f.write("! Frequency to tune the above note to\n")
+    f.write(f"{base_freq:f}\n")
+    f.write("! Scale degree to consider as formal octave:\n")
+    f.write(f"{size}\n")
+    f.write("! Mapping.\n")
+    for degree in range(size):
+        f.write(f"{degree}\n")
+
+
+def write_csv(f: IO[str], parent: CPS, cps_iter: Iterable[CPS]) -> None:
+    """
+    Write a table in the format of hexanies.csv: a header with the parent's
+    name, transposition and factors, the parent's ratios, then one row per
+    embedded CPS with its ratios in the parent's columns.
+    """
+    f.write(f"{parent.name} @ {parent.transposition},{parent.list_factors(stars=True)}\n")
+    f.write(",")
+    parent.write_scale(f, tabular=True, csv=True)
+    f.write("\n")
+    for cps in cps_iter:
+        f.write(f"{csv_name(cps)},")
+        cps.write_scale(f, tabular=True, csv=True)
+        f.write("\n")
+
+
+def write_freqs(f: IO[str],
+                cps_iter: Iterable[CPS],
+                base_freq: float = BASE_FREQ,
+                names: bool = False) -> None:
+    """
+    Write a tab-separated frequency table like freqs.txt: one row per embedded
+    CPS, with the frequency of each of its tones in the parent's column for
+    that tone and empty columns elsewhere. The 1/1 sounds at base_freq.
+    """
+    for cps in cps_iter:
+        row = [""] * cps.parent.size
+        for elm, i in zip(cps.elements, cps.relative_index):
+            row[i] = f"{base_freq * float(elm.ratio_n):f}"
+        if names:
+            row.insert(0, csv_name(cps))
+        f.write('\t'.join(row))
+        f.write('\n')
+
+
+def write_gen51(f: IO[str],
+                cps_iter: Iterable[CPS],
+                base_freq: float = BASE_FREQ,
+                base_key: int = BASE_KEY,
+                table_size: int = 128,
+                prefix: str = "gi_tab_",
+                start: int = 0) -> int:
+    """
+    Write one Csound GEN51 tuning table definition (an ftgen statement) per CPS,
+    named prefix followed by a sequence number counting from start. Returns the
+    number of tables written.
+    """
+    count = 0
+    for count, cps in enumerate(cps_iter, 1):
+        f.write(f"; {cps.name}\n"
+                f"{prefix}{start + count - 1} = ftgen(0, 0, {table_size}, -51,\n"
+                f"{'':19}{cps.size}, 2, {base_freq}, {base_key},\n"
+                f"{'':19}{cps.list_scale(csv=True)})\n\n")
+    return count
+
+
+def write_quantizer(f: IO[str], cps: CPS, name: str) -> None:
+    """
+    Write a Csound table, named name, that maps each o_C note value (0 to
+    O_C_RESOLUTION - 1) to the index of the highest element of cps at or below
+    it, built from cps.o_C_map as a GEN17 step function. Values below the lowest
+    element map to the highest one, i.e. to the octave below.
+    """
+    steps = {}
+    for note, i in sorted(cps.o_C_map.items()):
+        steps.setdefault(note % O_C_RESOLUTION, i)
+    notes = sorted(steps)
+    pairs = [] if notes[0] == 0 else [(0, steps[notes[-1]])]
+    pairs.extend((note, steps[note]) for note in notes)
+    f.write(f"{name} = ftgen(0, 0, -{O_C_RESOLUTION}, -17, "
+            f"{', '.join(f'{note}, {i}' for note, i in pairs)})\n")
+
+
+def _all_transpositions(parent: CPS) -> List[Tuple[int, str]]:
+    return [(reduce(mul, elm.factors, 1), '*'.join(str(f) for f in elm.factors)) for elm in parent.elements]
+
+
+def write_csound_include(f: IO[str],
+                         parent: CPS,
+                         embedded: Tuple[int, int],
+                         transpositions: Iterable[Tuple[int, str]] = None,
+                         base_freq: float = BASE_FREQ,
+                         base_key: int = BASE_KEY,
+                         table_size: int = 128,
+                         prefix: str = "gi_cps_",
+                         quantizers: bool = True) -> int:
+    """
+    Write a Csound include file with a GEN51 tuning table (see write_gen51())
+    for each CPS of the given (size, choose) embedded in each transposition of
+    parent (default: with every element of parent as the 1/1), and, unless
+    quantizers is False, a note lookup table for each (see write_quantizer()).
+
+    Index tables {prefix}tuning and {prefix}quantize hold the numbers of these
+    tables, in order: set s of transposition t is at t * CPS_NUM_SETS + s. An
+    instrument can then switch scales at k-rate with a table read, e.g.
+
+        ktab = table:k(ktrans * $CPS_NUM_SETS + kset, gi_cps_tuning)
+        kcps = cpstun(ktrig, kkey, ktab)
+
+    Returns the number of sets written.
+    """
+    size, choose = embedded
+    if transpositions is None:
+        transpositions = _all_transpositions(parent)
+    transpositions = list(transpositions)
+
+    f.write(f"; {parent.name}: {size} choose {choose} sets in {len(transpositions)} transposition(s)\n"
+            f"; generated by cps_export.write_csound_include()\n\n")
+
+    count = 0
+    sets_per_transposition = None
+    for tr in transpositions:
+        f.write(f"; ----- 1/1 = {tr[1]}\n\n")
+        cps_list = list(parent.transpose(*tr).iter_embedded_cps(size, choose, transpose=tr))
+        if sets_per_transposition is None:
+            sets_per_transposition = len(cps_list)
+        write_gen51(f, cps_list, base_freq, base_key, table_size, f"{prefix}tun_", count)
+        if quantizers:
+            for i, cps in enumerate(cps_list, count):
+                write_quantizer(f, cps, f"{prefix}q_{i}")
+            f.write("\n")
+        count += len(cps_list)
+
+    f.write(f"#define CPS_NUM_SETS #{sets_per_transposition or 0}#\n"
+            f"#define CPS_NUM_TRANSPOSITIONS #{len(transpositions)}#\n\n")
+    for kind, name in (("tuning", "tun"), ("quantize", "q")) if quantizers else (("tuning", "tun"),):
+        f.write(f"{prefix}{kind} = ftgen(0, 0, -{max(count, 1)}, -2, 0)\n")
+        for i in range(count):
+            f.write(f"tableiw({prefix}{name}_{i}, {i}, {prefix}{kind})\n")
+        f.write("\n")
+    return count
+
+
+def export(path: str, writer, *args: Union[CPS, Iterable[CPS]], **kwargs) -> None:
+    """
+    Run one of the writers above on a new file, e.g.
+    export("hexanies.csv", write_csv, eikosany, eikosany.iter_embedded_cps(4, 2)).
+    """
+    with open_export(path) as f:
+        writer(f, *args, **kwargs)
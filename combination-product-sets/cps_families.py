@@ -0,0 +1,158 @@
+"""
+Generalized CPS families, built by one engine from pluggable generators:
+stellated CPS, sets with mixed choose values, combinations with repeated
+factors, and Euler-Fokker genera.
+
+A generator yields the elements of a family as tuples of indexes into its
+(distinct) factors, e.g. (0, 0, 2) for factors[0]**2 * factors[2]. build()
+multiplies them out, drops elements that duplicate a tone already in the set
+and stores the rest in a CompactElements table, so the result is an ordinary
+(compact) CPS: it can be transposed, listed and compared like any other.
+
+locate() places CPS instances (e.g., the hexany inside a stellated hexany) in
+a family, which gives them masks (see CPS.mask) relative to it, so that
+CPS.find_common_tones(), CommonToneGraph and cps_numpy.mask_matrix() work
+across the family.
+
+Example:
+    family = stellated([3, 5, 7, 11], 2)
+    hexany = locate(family, [CPS([3, 5, 7, 11], 2)])[0]
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from itertools import combinations, combinations_with_replacement, product
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from cps import CPS, CompactElements, octave_reduce_pair
+
+
+Combo = Tuple[int, ...]
+
+
+def choose_combos(n: int, choose: int) -> Iterator[Combo]:
+    """
+    The elements of an ordinary n choose k CPS.
+    """
+    return combinations(range(n), choose)
+
+
+def mixed_combos(n: int, chooses: Iterable[int]) -> Iterator[Combo]:
+    """
+    The union of the n choose k sets for every k in chooses.
+    """
+    for choose in chooses:
+        yield from combinations(range(n), choose)
+
+
+def stellated_combos(n: int, choose: int) -> Iterator[Combo]:
+    """
+    A CPS together with the sets of one fewer and one more factor per element,
+    e.g. the stellated hexany: 4 choose 1, 2 and 3.
+    """
+    return mixed_combos(n, [k for k in (choose - 1, choose, choose + 1) if 0 < k < n])
+
+
+def repeated_combos(n: int, choose: int) -> Iterator[Combo]:
+    """
+    Products of choose factors in which a factor may be used more than once.
+    """
+    return combinations_with_replacement(range(n), choose)
+
+
+def euler_fokker_combos(counts: Sequence[int]) -> Iterator[Combo]:
+    """
+    Every divisor of the product of the factors raised to the given counts,
+    including 1, i.e. the tones of an Euler-Fokker genus.
+    """
+    for powers in product(*(range(count + 1) for count in counts)):
+        yield tuple(i for i, power in enumerate(powers) for _ in range(power))
+
+
+def build(factors: Sequence[int],
+          combos: Iterable[Combo],
+          name: str = None,
+          dedup: bool = True) -> CPS:
+    """
+    Build a compact CPS from the given elements (tuples of indexes into factors,
+    which must be distinct). Unless dedup is False, an element whose octave
+    reduced ratio is already in the set is dropped, keeping the first one
+    generated.
+    """
+    factors = list(factors)
+    if not factors:
+        raise ValueError("No factors specified")
+    if len(set(factors)) != len(factors):
+        raise ValueError(f"Factors must be distinct: {factors}")
+
+    if dedup:
+        seen = set()
+        unique = []
+        for combo in combos:
+            prod = 1
+            for i in combo:
+                prod *= factors[i]
+            ratio = octave_reduce_pair(prod, 1)
+            if ratio not in seen:
+                seen.add(ratio)
+                unique.append(combo)
+        combos = unique
+
+    elements = CompactElements.from_combos(factors, combos)
+    if not len(elements):
+        raise ValueError("No elements generated")
+    return CPS.from_elements(factors, elements, name=name)
+
+
+def stellated(factors: Sequence[int], choose: int, name: str = None) -> CPS:
+    return build(factors, stellated_combos(len(factors), choose),
+                 name if name else f"stellated {'-'.join(str(f) for f in factors)} {choose}")
+
+
+def mixed(factors: Sequence[int], chooses: Iterable[int], name: str = None) -> CPS:
+    chooses = list(chooses)
+    return build(factors, mixed_combos(len(factors), chooses),
+                 name if name else f"{'-'.join(str(f) for f in factors)} {'+'.join(str(k) for k in chooses)}")
+
+
+def repeated(factors: Sequence[int], choose: int, name: str = None) -> CPS:
+    return build(factors, repeated_combos(len(factors), choose),
+                 name if name else f"{'-'.join(str(f) for f in factors)} {choose} with repetition")
+
+
+def euler_fokker(factors: Sequence[int], name: str = None) -> CPS:
+    """
+    The Euler-Fokker genus of a multiset of factors, e.g. [3, 3, 5, 7] for
+    the genus [3^2 5 7].
+    """
+    counts = Counter(factors)
+    distinct = sorted(counts)
+    return build(distinct, euler_fokker_combos([counts[f] for f in distinct]),
+                 name if name else f"Euler-Fokker [{' '.join(str(f) for f in factors)}]")
+
+
+def locate(family: CPS, cps_list: Iterable[CPS]) -> List[CPS]:
+    """
+    Return views of CPS instances with family as their parent and the positions
+    of their tones in it as relative index. Each instance must be in the same
+    transposition as the family, and all of its tones must be in the family.
+    """
+    index = {(elm._num, elm._den): i for i, elm in enumerate(family.elements)}
+    located = []
+    for cps in cps_list:
+        if cps.transposition_n != family.transposition_n:
+            raise ValueError(f"{cps.name} is not in the same transposition as {family.name}")
+        try:
+            relative_index = [index[elm._num, elm._den] for elm in cps.elements]
+        except KeyError:
+            raise ValueError(f"{cps.name} is not contained in {family.name}")
+        located.append(CPS.from_elements(cps.factors,
+                                         cps.elements,
+                                         multiplier=cps.multiplier,
+                                         name=cps.name,
+                                         parent=family,
+                                         transposition=(cps.transposition_n, cps.transposition),
+                                         relative_index=relative_index,
+                                         choose=cps.choose))
+    return located
@@ -10,15 +10,21 @@ from itertools import combinations, repeat
 import math
 from operator import mul
 from pprint import pformat
+import sys
 from typing import Dict, List, Set, Tuple
 
+from cps import CPS, parse_transposition
+from cps_equivalence import EquivalenceIndex, canonical_key, digest
+from cps_export import write_csv
+from cps_graph import CommonToneGraph
+
 
 def transpose_and_spawn(parent: CPS,
                         tr: Tuple[int, Str],
                         length: int,
                         choose: int):
     if tr:
-        parent.transpose(tr[0], tr[1])
+        parent = parent.transpose(tr[0], tr[1])
     return parent.find_embedded_cps(length, choose, transpose=tr)
 
 
@@ -30,29 +36,33 @@ def print_cps(cps: CPS) -> None:
     print(f"\n{'ratios:':>10} {cps.list_scale()}")
     # print(f"\nterms:\t{cps.list_factors(stars=True)}")
     print(f"{'o_C notes:':>10} {cps.o_C_notes}")
-    # print(cps._o_C_map)
+    # print(cps.o_C_map)
 
 
-def print_cps_transpositions(cps: CPS, factors: List[int]) -> None:
+def print_cps_transpositions(cps: CPS, factors: List[int], choose: int = 3) -> None:
     """
-    Print all the transpositions of a CPS instance
+    Print all the transpositions of a CPS instance, one for each choose-factor
+    combination of factors
     """
-    combos = combinations(factors, 3)
+    combos = combinations(factors, choose)
     for combo in combos:
-        cps.transpose(reduce(mul, combo, 1), f"{combo[0]}*{combo[1]}*{combo[2]}")
+        transposed = cps.transpose(reduce(mul, combo, 1), "*".join(str(f) for f in combo))
         print("\n-----\n")
-        print(cps)
+        print(transposed)
         print()
         # print(cps.get_scale())
 
 
-def print_hexanies(eikosany: CPS, transposition: Tuple[int, Str]) -> None:
+def print_hexanies(eikosany: CPS,
+                   transposition: Tuple[int, Str],
+                   embedded: Tuple[int, int] = (4, 2)) -> None:
     """
-    Set 1/1 to ??? and print out all the embedded hexanies in various ways
+    Set 1/1 to ??? and print out all the embedded hexanies (or other embedded
+    CPS, given as size, choose) in various ways
     """
     print(f"\n=====\n\nHexanies contained in {eikosany.name}, 1/1 = {transposition[1]}:")
-    eikosany.transpose(transposition[0], transposition[1])
-    hexanies = eikosany.find_embedded_cps(4, 2, transpose=transposition)
+    eikosany = eikosany.transpose(transposition[0], transposition[1])
+    hexanies = eikosany.find_embedded_cps(embedded[0], embedded[1], transpose=transposition)
 
     # human-readable ASCII table
     print(f"reference:\t\t{eikosany.list_scale(tabular=True)}")
@@ -73,17 +83,12 @@ def print_hexanies(eikosany: CPS, transposition: Tuple[int, Str]) -> None:
         print(f"{hex.name}:\t{hex.relative_index}")
 
 
-def print_hexanies_csv(eikosany: CPS, transposition: Tuple[int, Str]) -> None:
-    eikosany.transpose(transposition[0], transposition[1])
-    hexanies = eikosany.find_embedded_cps(4, 2, transpose=transposition)
-
-    print(f"{eikosany.name} @ {eikosany.transposition},{eikosany.list_factors(stars=True)}")
-    print(f",{eikosany.list_scale(tabular=True, csv=True)}")
-
-    for hex in hexanies:
-        name = hex.name.replace(" ", "")
-        name = name.replace(",", "-")
-        print(f"{name},{hex.list_scale(tabular=True, csv=True)}")
+def print_hexanies_csv(eikosany: CPS,
+                       transposition: Tuple[int, Str],
+                       embedded: Tuple[int, int] = (4, 2)) -> None:
+    eikosany = eikosany.transpose(transposition[0], transposition[1])
+    hexanies = eikosany.iter_embedded_cps(embedded[0], embedded[1], transpose=transposition)
+    write_csv(sys.stdout, eikosany, hexanies)
 
 
 def print_hexanies_common_tones(eikosany: CPS, hexanies: List[CPS], index: int):
@@ -97,17 +102,17 @@ def print_hexanies_common_tones(eikosany: CPS, hexanies: List[CPS], index: int):
 
 
 def print_hexanies2(eikosany: CPS) -> None:
-    factors = {
-        eval(f): f
+    factors = dict(
+        parse_transposition(f)
         for f in eikosany.list_factors(stars=True).split(',')
-    }
+    )
     sorted(factors.items(), key=lambda f: f[0])
     for n, s in factors.items():
         print(f"\n=====\n\n1/1 Hexanies contained in {eikosany.name}, 1/1 = {s}:")
-        eikosany.transpose(n, s)
-        print(f"{'Reference:':<19}\t{eikosany.list_scale(tabular=True)}")
+        transposed = eikosany.transpose(n, s)
+        print(f"{'Reference:':<19}\t{transposed.list_scale(tabular=True)}")
 
-        hexanies = eikosany.find_embedded_cps(4, 2, transpose=(n, s))
+        hexanies = transposed.find_embedded_cps(4, 2, transpose=(n, s))
         for hex in hexanies:
             for i, r in enumerate(hex.ratios):
                 if r == 1:
@@ -119,8 +124,7 @@ def print_hexanies2(eikosany: CPS) -> None:
 
     print("All 1-3-5-7 hexanies across the set of eikosany transpositions")
     for n, s in factors.items():
-        eikosany.transpose(n, s)
-        hexanies = eikosany.find_embedded_cps(4, 2, transpose=(n, s))
+        hexanies = eikosany.transpose(n, s).find_embedded_cps(4, 2, transpose=(n, s))
         for hex in hexanies:
             if hex.product == 1*3*5*7:
                 print(f"{s:<7} {hex.name}:\t{hex.list_scale(tabular=True)}")
@@ -128,8 +132,7 @@ def print_hexanies2(eikosany: CPS) -> None:
 
     # print("All 1-3-5-7 hexanies that start at 1/1 in their respective eikosany transpositions")
     # for n, s in factors.items():
-    #     eikosany.transpose(n, s)
-    #     hexanies = eikosany.find_embedded_cps(4, 2, transpose=(n, s))
+    #     hexanies = eikosany.transpose(n, s).find_embedded_cps(4, 2, transpose=(n, s))
     #     for hex in hexanies:
     #         if hex.product == 1*3*5*7 and hex.ratios[0] == 1:
     #                 print(f"{s:<7} {hex.name}:\t{hex.list_scale(tabular=True)}")
@@ -162,3 +165,57 @@ def collect_hexanies(parent: CPS, hexanies: List[CPS], names: List[str]) -> List
         print(f"{c.name:<19}\t{','.join([n for n in notes])}")
 
     return collection
+
+
+def print_common_tone_paths(parent: CPS, cps_list: List[CPS], min_common: int = 1) -> CommonToneGraph:
+    """
+    Print a tour through all the CPS instances that maximizes common tones between
+    neighbors, and a shortest path through them that covers all the tones
+    """
+    graph = CommonToneGraph(cps_list, min_common=min_common)
+
+    print(f"reference:\t\t{parent.list_scale(tabular=True)}")
+    print()
+
+    try:
+        tour = graph.best_tour()
+        if tour:
+            print(f"tour with {tour[0]} common tones:")
+            for c in tour[1]:
+                print(f"{c.name:<19}\t{c.list_scale(tabular=True)}")
+        else:
+            print(f"no tour with at least {min_common} common tones")
+    except ValueError as e:
+        # the search gave up before settling whether there is a tour
+        print(e)
+
+    print()
+
+    path = graph.covering_path()
+    if path:
+        print(f"covering all tones with {len(path)} sets:")
+        for c in path:
+            print(f"{c.name:<19}\t{c.list_scale(tabular=True)}")
+    else:
+        print("no path covers all tones")
+
+    return graph
+
+
+def print_equivalence_classes(parent: CPS, length: int, choose: int, key=canonical_key) -> EquivalenceIndex:
+    """
+    Group the CPS embedded in every transposition of parent by key (by default,
+    equal up to rotation; tone_key groups identical sets of tones), and print
+    one scale per group, followed by the (set, transposition) pairs in it.
+    """
+    index = EquivalenceIndex(key)
+    for elm in parent.elements:
+        tr = (reduce(mul, elm.factors, 1), '*'.join(str(f) for f in elm.factors))
+        index.add_all(parent.transpose(*tr).iter_embedded_cps(length, choose, transpose=tr))
+
+    print(f"{index.count} CPS in {len(index)} classes")
+    for key, members in index.classes():
+        print(f"\n{digest(key)[:12]}\t{members[0].list_scale(tabular=True)}")
+        for cps in members:
+            print(f"\t{cps.transposition:<7} {cps.name}")
+    return index
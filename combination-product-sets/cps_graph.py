@@ -0,0 +1,338 @@
+"""
+Common-tone graphs over families of CPS instances embedded in the same parent
+(e.g., the hexanies in an eikosany), with searches for voice-leading paths that
+move from set to set through shared tones.
+"""
+
+from __future__ import annotations
+
+from typing import Iterator, List, Tuple, Union
+
+from cps import CPS, popcount
+
+
+# default number of search steps best_tour() and covering_path() take before
+# settling for the best (or a greedy) result
+SEARCH_LIMIT = 1000000
+
+
+class _SearchLimit(Exception):
+    pass
+
+
+class CommonToneGraph(object):
+    """
+    Weighted graph with one node per CPS instance and an edge between every pair
+    of instances sharing at least min_common tones, weighted by the number of
+    tones they share. The weights are computed once, when the graph is created,
+    and search results are cached.
+    """
+    def __init__(self, cps_list: List[CPS], min_common: int = 1):
+        if not cps_list:
+            raise ValueError("No CPS instances specified")
+        parent = cps_list[0].parent
+        transposition = cps_list[0].transposition_n
+        if parent is None or any(cps.parent is not parent or cps.transposition_n != transposition
+                                 for cps in cps_list):
+            raise ValueError("All CPS instances must be embedded in the same parent, in the same transposition")
+
+        self._cps_list = list(cps_list)
+        self._parent = parent
+        self._min_common = min_common
+        self._masks = [cps.mask for cps in self._cps_list]
+
+        size = len(self._cps_list)
+        self._weights = [[0] * size for _ in range(size)]
+        for i in range(size):
+            for j in range(i + 1, size):
+                self._weights[i][j] = self._weights[j][i] = popcount(self._masks[i] & self._masks[j])
+
+        # neighbors of each node, heaviest edges first
+        self._neighbors = [
+            sorted(((w, j) for j, w in enumerate(row) if j != i and w >= min_common), reverse=True)
+            for i, row in enumerate(self._weights)
+        ]
+
+        self._memo = {}
+
+    @property
+    def cps_list(self) -> List[CPS]:
+        return self._cps_list
+
+    @property
+    def parent(self) -> CPS:
+        return self._parent
+
+    @property
+    def size(self) -> int:
+        return len(self._cps_list)
+
+    @property
+    def min_common(self) -> int:
+        return self._min_common
+
+    def weight(self, i: int, j: int) -> int:
+        return self._weights[i][j]
+
+    def neighbors(self, i: int) -> List[Tuple[int, CPS]]:
+        """
+        The CPS instances connected to the one at index i, with the number of
+        tones shared with each, most shared tones first.
+        """
+        return [(w, self._cps_list[j]) for w, j in self._neighbors[i]]
+
+    def iter_paths(self, length: int, start: Union[int, None] = None) -> Iterator[List[CPS]]:
+        """
+        Generate every path through length distinct CPS instances (optionally
+        starting with the one at index start) in which consecutive instances
+        share at least min_common tones.
+        """
+        def walk(path: List[int], visited: int) -> Iterator[List[int]]:
+            if len(path) == length:
+                yield path
+                return
+            for _, j in self._neighbors[path[-1]]:
+                if not visited >> j & 1:
+                    yield from walk(path + [j], visited | 1 << j)
+
+        starts = range(self.size) if start is None else [start]
+        for i in starts:
+            for path in walk([i], 1 << i):
+                yield [self._cps_list[j] for j in path]
+
+    def best_tour(self,
+                  start: Union[int, None] = None,
+                  limit: int = SEARCH_LIMIT) -> Union[Tuple[int, List[CPS]], None]:
+        """
+        Find a path that visits every CPS instance once (optionally starting with
+        the one at index start) and maximizes the total number of tones shared
+        between consecutive instances. Returns the total and the path, or None if
+        there is no such path.
+
+        This is a branch and bound search: branches that can't beat the best tour
+        so far are pruned, as are states (instances visited, current instance)
+        already reached with at least the same total. If the search takes more
+        than limit steps, the better of the best tour found so far and a greedy
+        tour (always moving to the unvisited instance sharing the most tones) is
+        returned. If neither exists, ValueError is raised, as there may still be
+        a tour.
+        """
+        key = ('best_tour', start, limit)
+        if key not in self._memo:
+            self._memo[key] = self._best_tour(start, limit)
+        return self._memo[key]
+
+    def covering_path(self,
+                      start: Union[int, None] = None,
+                      limit: int = SEARCH_LIMIT) -> Union[List[CPS], None]:
+        """
+        Find a shortest path (optionally starting with the CPS instance at index
+        start) that covers every tone of the parent reached by the instances, with
+        consecutive instances sharing at least min_common tones. Returns None if
+        there is no such path.
+
+        This is an iterative deepening search over (current instance, tones
+        covered) states. Branches are pruned when the tones left to cover can't
+        be reached in the steps left, and states that have already failed with
+        at least as many steps left are remembered and skipped. If the search
+        takes more than limit steps, a greedy path (always moving to the instance
+        that adds the most new tones) is returned instead, which covers every tone
+        but may not be the shortest.
+        """
+        key = ('covering_path', start, limit)
+        if key not in self._memo:
+            self._memo[key] = self._covering_path(start, limit)
+        return self._memo[key]
+
+    def _best_tour(self, start: Union[int, None], limit: int) -> Union[Tuple[int, List[CPS]], None]:
+        size = self.size
+        full = (1 << size) - 1
+        if size == 1:
+            return 0, list(self._cps_list)
+        if not self._connected():
+            return None
+
+        # no tour can gain more entering a node than its heaviest edge
+        heaviest = [self._neighbors[i][0][0] if self._neighbors[i] else 0 for i in range(size)]
+
+        best_total = -1
+        best_path = None
+        seen = {}
+        steps = 0
+
+        # depth-first, heaviest edges first, with an explicit stack so that the
+        # depth isn't limited by the recursion limit
+        for i in ([start] if start is not None else range(size)):
+            path = [i]
+            totals = [0]
+            remaining = [sum(heaviest) - heaviest[i]]
+            visited = 1 << i
+            stack = [iter(self._neighbors[i])]
+            while stack and steps < limit:
+                steps += 1
+                edge = next(stack[-1], None)
+                if edge is None:
+                    stack.pop()
+                    visited &= ~(1 << path.pop())
+                    totals.pop()
+                    remaining.pop()
+                    continue
+
+                w, j = edge
+                if visited >> j & 1:
+                    continue
+                total = totals[-1] + w
+                if visited | 1 << j == full:
+                    if total > best_total:
+                        best_total, best_path = total, path + [j]
+                    continue
+                if total + remaining[-1] - heaviest[j] <= best_total:
+                    continue
+                state = (visited | 1 << j, j)
+                if seen.get(state, -1) >= total:
+                    continue
+                seen[state] = total
+
+                path.append(j)
+                totals.append(total)
+                remaining.append(remaining[-1] - heaviest[j])
+                visited |= 1 << j
+                stack.append(iter(self._neighbors[j]))
+
+        if steps >= limit:
+            for i in ([start] if start is not None else range(size)):
+                found = self._greedy_tour(i)
+                if found and found[0] > best_total:
+                    best_total, best_path = found
+            if best_path is None:
+                raise ValueError(f"No tour found in {limit} search steps")
+        if best_path is None:
+            return None
+        return best_total, [self._cps_list[i] for i in best_path]
+
+    def _greedy_tour(self, i: int) -> Union[Tuple[int, List[int]], None]:
+        """
+        Tour starting with the instance at index i that always moves to the
+        unvisited instance sharing the most tones, or None if it gets stuck.
+        """
+        total = 0
+        path = [i]
+        visited = 1 << i
+        while len(path) < self.size:
+            for w, j in self._neighbors[path[-1]]:
+                if not visited >> j & 1:
+                    break
+            else:
+                return None
+            total += w
+            path.append(j)
+            visited |= 1 << j
+        return total, path
+
+    def _covering_path(self, start: Union[int, None], limit: int) -> Union[List[CPS], None]:
+        full = 0
+        for mask in self._masks:
+            full |= mask
+
+        starts = [i for i in (range(self.size) if start is None else [start]) if self._component(i) == full]
+        if not starts:
+            return None
+
+        # each step adds at most this many tones
+        most_new = max(1, max(popcount(mask) for mask in self._masks) - self._min_common)
+
+        # (instance, tones covered) -> largest number of steps left with which
+        # that state was searched without success
+        failed = {}
+        steps = 0
+
+        def search(i: int, covered: int, left: int, path: List[int]) -> Union[List[int], None]:
+            nonlocal steps
+            steps += 1
+            if steps > limit:
+                raise _SearchLimit()
+            if covered == full:
+                return path
+            uncovered = popcount(full & ~covered)
+            if left * most_new < uncovered or failed.get((i, covered), -1) >= left:
+                return None
+            gains = sorted(((popcount(self._masks[j] & ~covered), j) for _, j in self._neighbors[i]),
+                           reverse=True)
+            for _, j in gains:
+                found = search(j, covered | self._masks[j], left - 1, path + [j])
+                if found:
+                    return found
+            failed[(i, covered)] = left
+            return None
+
+        # iterative deepening, so the first path found is a shortest one; a walk
+        # through a connected graph never needs more than 2 * size steps
+        try:
+            for depth in range(2 * self.size):
+                for i in starts:
+                    found = search(i, self._masks[i], depth, [i])
+                    if found:
+                        return [self._cps_list[j] for j in found]
+        except _SearchLimit:
+            pass
+
+        # greedy fallback, from the start that covers the most tones
+        path = [max(starts, key=lambda i: popcount(self._masks[i]))]
+        covered = self._masks[path[0]]
+        while covered != full:
+            path.extend(self._nearest_gain(path[-1], covered))
+            covered |= self._masks[path[-1]]
+        return [self._cps_list[j] for j in path]
+
+    def _nearest_gain(self, i: int, covered: int) -> List[int]:
+        """
+        Shortest path from the instance at index i (not included) to the closest
+        instance that adds new tones to covered, preferring the one that adds the
+        most.
+        """
+        previous = {i: None}
+        level = [i]
+        while level:
+            next_level = []
+            for j in level:
+                for _, k in self._neighbors[j]:
+                    if k not in previous:
+                        previous[k] = j
+                        next_level.append(k)
+
+            gains = [k for k in next_level if self._masks[k] & ~covered]
+            if gains:
+                k = max(gains, key=lambda k: popcount(self._masks[k] & ~covered))
+                path = []
+                while k != i:
+                    path.append(k)
+                    k = previous[k]
+                return path[::-1]
+            level = next_level
+        raise ValueError("No instance reachable from here adds new tones")
+
+    def _component(self, i: int) -> int:
+        """
+        Tones covered by all the instances reachable from the one at index i.
+        """
+        covered = 0
+        visited = {i}
+        todo = [i]
+        while todo:
+            j = todo.pop()
+            covered |= self._masks[j]
+            for _, k in self._neighbors[j]:
+                if k not in visited:
+                    visited.add(k)
+                    todo.append(k)
+        return covered
+
+    def _connected(self) -> bool:
+        visited = {0}
+        todo = [0]
+        while todo:
+            for _, k in self._neighbors[todo.pop()]:
+                if k not in visited:
+                    visited.add(k)
+                    todo.append(k)
+        return len(visited) == self.size
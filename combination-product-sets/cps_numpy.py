@@ -0,0 +1,239 @@
+"""
+Vectorized NumPy batch mode for building a CPS and all of its transpositions
+in one pass, and for comparing whole families of embedded CPS instances.
+
+Requires NumPy, which the rest of the CPS code does not.
+"""
+
+from __future__ import annotations
+
+from functools import reduce
+from itertools import combinations
+from operator import mul
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from cps import CPS, CpsElement, O_C_RESOLUTION
+
+
+# largest number of bits we let an intermediate value use before falling back
+# from int64 arrays to (much slower) arrays of Python ints
+INT64_BITS = 62
+
+
+class CpsFamily(object):
+    """
+    A CPS together with a set of its transpositions, held as 2-D arrays with
+    one row per transposition divisor and one column per element. Each row is
+    sorted by pitch, the same way CPS sorts its elements.
+    """
+    def __init__(self,
+                 factors: List[int],
+                 choose: int,
+                 multiplier: int,
+                 divisors: np.ndarray,
+                 labels: List[str],
+                 combos: List[Tuple[int, ...]],
+                 order: np.ndarray,
+                 nums: np.ndarray,
+                 dens: np.ndarray,
+                 prod_nums: np.ndarray,
+                 prod_dens: np.ndarray):
+        self._factors = factors
+        self._choose = choose
+        self._multiplier = multiplier
+        self._divisors = divisors
+        self._labels = labels
+        self._combos = combos
+        self._order = order
+        self._nums = nums
+        self._dens = dens
+        self._prod_nums = prod_nums
+        self._prod_dens = prod_dens
+        self._pitches = None
+        self._notes = {}
+
+    @property
+    def factors(self) -> List[int]:
+        return self._factors
+
+    @property
+    def choose(self) -> int:
+        return self._choose
+
+    @property
+    def divisors(self) -> np.ndarray:
+        return self._divisors
+
+    @property
+    def labels(self) -> List[str]:
+        return self._labels
+
+    @property
+    def combos(self) -> List[Tuple[int, ...]]:
+        """
+        Factors of each element (including the multiplier, if any), in
+        itertools.combinations order; the order array indexes into this.
+        """
+        return self._combos
+
+    @property
+    def order(self) -> np.ndarray:
+        return self._order
+
+    @property
+    def nums(self) -> np.ndarray:
+        return self._nums
+
+    @property
+    def dens(self) -> np.ndarray:
+        return self._dens
+
+    @property
+    def pitches(self) -> np.ndarray:
+        """
+        log2 of each reduced ratio (0 for 1/1, approaching 1 for 2/1).
+        """
+        if self._pitches is None:
+            self._pitches = np.log2(self._nums.astype(np.float64) / self._dens.astype(np.float64))
+        return self._pitches
+
+    def notes(self, resolution: int = O_C_RESOLUTION) -> np.ndarray:
+        """
+        Each element as a step of an equal division of the octave into resolution
+        steps (see CPS.notes()), cached per resolution.
+        """
+        if resolution not in self._notes:
+            ratios = self._nums.astype(np.float64) / self._dens.astype(np.float64)
+            self._notes[resolution] = np.round(resolution * (np.log(ratios) / np.log(2))).astype(np.int64)
+        return self._notes[resolution]
+
+    @property
+    def o_C_notes(self) -> np.ndarray:
+        return self.notes(O_C_RESOLUTION)
+
+    def __len__(self) -> int:
+        return len(self._divisors)
+
+    def cps(self, row: int, name: str = None) -> CPS:
+        """
+        Return the transposition in the given row as a CPS, built directly
+        from the arrays.
+        """
+        elements = [
+            CpsElement.from_parts(self._combos[i],
+                                  reduce(mul, self._combos[i], 1),
+                                  (int(pn), int(pd)),
+                                  (int(n), int(d)),
+                                  rank=None if self._multiplier else int(i))
+            for i, n, d, pn, pd in zip(self._order[row], self._nums[row], self._dens[row],
+                                       self._prod_nums[row], self._prod_dens[row])
+        ]
+        return CPS.from_elements(self._factors,
+                                 elements,
+                                 multiplier=self._multiplier,
+                                 name=name,
+                                 transposition=(int(self._divisors[row]), self._labels[row]))
+
+
+def _scaled(prods: np.ndarray, divisors: np.ndarray, shifts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Numerators and denominators (not in lowest terms) of prods/divisors * 2**-shifts,
+    as a (divisors x prods) pair of arrays.
+    """
+    return (prods[np.newaxis, :] << np.maximum(0, -shifts),
+            divisors[:, np.newaxis] << np.maximum(0, shifts))
+
+
+def build_family(factors: List[int],
+                 choose: int = None,
+                 divisors: Sequence[int] = (1,),
+                 labels: Sequence[str] = None,
+                 multiplier: int = None) -> CpsFamily:
+    """
+    Build every transposition of the CPS given by factors/choose/multiplier,
+    one for each divisor, in a single vectorized pass.
+    """
+    if not factors:
+        raise ValueError("No factors specified")
+    if not choose:
+        choose = int(len(factors)/2)
+
+    combos = [tuple(sorted(combo + (multiplier,))) if multiplier else tuple(sorted(combo))
+              for combo in combinations(factors, choose)]
+    prods = [reduce(mul, combo, 1) for combo in combos]
+    divisors = [int(d) for d in divisors]
+    labels = list(labels) if labels else [str(d) for d in divisors]
+
+    # the sort keys are usually the widest values we compute: a product shifted
+    # by at most the spread of octaves between the smallest and largest product
+    pbits = [p.bit_length() for p in prods]
+    dbits = max(d.bit_length() for d in divisors)
+    widest = max(2 * max(pbits) - min(pbits), dbits) + 2
+    dtype = np.int64 if widest <= INT64_BITS else object
+    p = np.array(prods, dtype=dtype)
+    d = np.array(divisors, dtype=dtype)
+
+    # octave shift k such that p/d * 2**-k is in [1, 2); the float estimate can
+    # be off by one, so correct it with exact integer comparisons
+    shifts = np.floor(np.log2(p.astype(np.float64))[np.newaxis, :]
+                      - np.log2(d.astype(np.float64))[:, np.newaxis]).astype(np.int64)
+    for _ in range(2):
+        lhs, rhs = _scaled(p, d, shifts)
+        shifts = np.where(lhs < rhs, shifts - 1, np.where(lhs >= 2 * rhs, shifts + 1, shifts))
+
+    # as in Ratio.octave_reduce, exact powers of two above 1/1 reduce to 2
+    lhs, rhs = _scaled(p, d, shifts)
+    shifts = shifts - ((lhs == rhs) & (shifts > 0))
+    lhs, rhs = _scaled(p, d, shifts)
+
+    gcd = np.gcd(lhs, rhs)
+    nums, dens = lhs // gcd, rhs // gcd
+
+    # unreduced product, after raising it by octaves to at least the divisor
+    prod_nums = p[np.newaxis, :] << np.maximum(0, -shifts)
+    gcd = np.gcd(prod_nums, d[:, np.newaxis])
+    prod_nums, prod_dens = prod_nums // gcd, d[:, np.newaxis] // gcd
+
+    # within a row the divisor is constant, so p * 2**(max shift - shift) is an
+    # exact integer sort key
+    keys = p[np.newaxis, :] << (shifts.max(axis=1, keepdims=True) - shifts)
+    order = np.argsort(keys, axis=1, kind="stable")
+
+    def take(a: np.ndarray) -> np.ndarray:
+        return np.take_along_axis(a, order, axis=1)
+
+    return CpsFamily(factors, choose, multiplier, np.array(divisors, dtype=dtype), labels, combos,
+                     order, take(nums), take(dens), take(prod_nums), take(prod_dens))
+
+
+def mask_matrix(cps_list: List[CPS]) -> np.ndarray:
+    """
+    Stack the masks (see CPS.mask) of CPS instances embedded in the same parent
+    as a boolean matrix with one row per CPS and one column per parent element
+    (columns of elements that repeat an earlier element's tone stay empty).
+    """
+    if not cps_list:
+        return np.zeros((0, 0), dtype=bool)
+    parent = cps_list[0].parent
+    transposition = cps_list[0].transposition_n
+    if parent is None or any(cps.parent is not parent or cps.transposition_n != transposition for cps in cps_list):
+        raise ValueError("All CPS instances must be embedded in the same parent, in the same transposition")
+
+    masks = np.zeros((len(cps_list), parent.size), dtype=bool)
+    for row, cps in enumerate(cps_list):
+        masks[row, cps.tone_index] = True
+    return masks
+
+
+def common_tone_matrix(cps_list: List[CPS]) -> np.ndarray:
+    """
+    Number of common tones between every pair of CPS instances embedded in the
+    same parent, as a square matrix (the diagonal holds the size of each CPS).
+
+    Entry (i, j) is the popcount of mask i AND mask j; for the whole family at
+    once that is the product of the 0/1 mask matrix with its transpose.
+    """
+    masks = mask_matrix(cps_list).astype(np.int32)
+    return masks @ masks.T
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Batch runner that builds and analyzes every CPS in a factor space (which
+factors, how many of them, which choose values, which transpositions), spreading
+the work over a pool of processes.
+
+Results come back from the workers in marshalled chunks and are merged in task
+order, so the output does not depend on the number of workers.
+
+Example:
+    python cps_sweep.py -f 1,3,5,7,11,13,17 -n 6 -c 3 -t all -e 4,2
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce
+from itertools import combinations, islice
+import json
+import marshal
+from operator import mul
+import os
+import sys
+from typing import Any, Callable, Iterable, Iterator, List, Sequence, Tuple, Union
+
+from cps import CPS
+
+
+# number of tasks (factor list + choose value) sent to a worker at a time
+CHUNK_SIZE = 16
+
+Task = Tuple[Tuple[int, ...], int, Union[str, Tuple[int, ...]]]
+
+
+class SweepSpec(object):
+    """
+    Describes a factor space to sweep: every combination of size factors taken
+    from factors, for every size in sizes, as a CPS for every choose value in
+    chooses (values that don't fit the size are skipped).
+
+    transpositions is either a list of divisors to apply to every CPS, "all"
+    for a transposition to each element of each CPS, or "none".
+    """
+    def __init__(self,
+                 factors: Sequence[int],
+                 sizes: Sequence[int],
+                 chooses: Sequence[int],
+                 transpositions: Union[str, Sequence[int]] = "none",
+                 embedded: Tuple[int, int] = None):
+        if not factors:
+            raise ValueError("No factors specified")
+        if any(f <= 0 for f in factors):
+            raise ValueError(f"Factors must be positive: {list(factors)}")
+        if isinstance(transpositions, str):
+            if transpositions not in ("all", "none"):
+                raise ValueError(f"Unknown transpositions: {transpositions}")
+        elif any(d <= 0 for d in transpositions):
+            raise ValueError(f"Transposition divisors must be positive: {list(transpositions)}")
+
+        self._factors = tuple(factors)
+        self._sizes = tuple(sizes)
+        self._chooses = tuple(chooses)
+        self._transpositions = transpositions if isinstance(transpositions, str) else tuple(transpositions)
+        self._embedded = tuple(embedded) if embedded else None
+
+    @property
+    def factors(self) -> Tuple[int, ...]:
+        return self._factors
+
+    @property
+    def sizes(self) -> Tuple[int, ...]:
+        return self._sizes
+
+    @property
+    def chooses(self) -> Tuple[int, ...]:
+        return self._chooses
+
+    @property
+    def transpositions(self) -> Union[str, Tuple[int, ...]]:
+        return self._transpositions
+
+    @property
+    def embedded(self) -> Union[Tuple[int, int], None]:
+        return self._embedded
+
+    def tasks(self) -> Iterator[Task]:
+        for size in self._sizes:
+            for factors in combinations(self._factors, size):
+                for choose in self._chooses:
+                    if 0 < choose < size:
+                        yield factors, choose, self._transpositions
+
+
+def summarize(cps: CPS, embedded: Tuple[int, int] = None) -> Tuple:
+    """
+    Default analysis of one transposition: factors, choose value, transposition
+    and o_C notes, plus, if embedded is given as (size, choose), the number of
+    CPS of that type embedded in it and how many of those contain the 1/1
+    (both None if they can't be counted).
+    """
+    result = (list(cps.factors), cps.choose, cps.transposition, cps.o_C_notes)
+    if embedded:
+        size, choose = embedded
+        if size >= len(cps.factors) or choose + 1 != cps.choose:
+            return result + (None, None)
+        count = with_unison = 0
+        try:
+            for child in cps.iter_embedded_cps(size, choose, transpose=(cps.transposition_n, cps.transposition)):
+                count += 1
+                # exactly 1/1, not just a note that rounds to 0
+                if any(elm._num == elm._den for elm in child.elements):
+                    with_unison += 1
+        except ValueError:
+            # one CPS that can't be analyzed mustn't abort the whole sweep
+            return result + (None, None)
+        result += (count, with_unison)
+    return result
+
+
+def run_task(task: Task, analyze: Callable[[CPS], Any]) -> List[Any]:
+    """
+    Build one CPS and analyze each of its transpositions.
+    """
+    factors, choose, transpositions = task
+    cps = CPS(factors, choose)
+    if transpositions == "none":
+        divisors = [(1, "1")]
+    elif transpositions == "all":
+        divisors = [(reduce(mul, elm.factors, 1), '*'.join(str(f) for f in elm.factors))
+                    for elm in cps.elements]
+    else:
+        divisors = [(d, str(d)) for d in transpositions]
+    return [analyze(cps.transpose(d, s)) for d, s in divisors]
+
+
+def run_chunk(tasks: List[Task], analyze: Callable[[CPS], Any]) -> bytes:
+    """
+    Worker entry point: run a chunk of tasks, and return the results in compact
+    (marshalled) form.
+    """
+    return marshal.dumps([run_task(task, analyze) for task in tasks])
+
+
+def chunked(tasks: Iterable[Task], size: int) -> Iterator[List[Task]]:
+    tasks = iter(tasks)
+    while True:
+        chunk = list(islice(tasks, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_sweep(spec: SweepSpec,
+              analyze: Callable[[CPS], Any] = None,
+              workers: int = None,
+              chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Run the sweep described by spec, yielding the result of analyze (which must
+    be a picklable, top-level function returning marshallable values; the
+    default is summarize) for every CPS transposition, in task order.
+
+    workers is the number of processes (default: one per CPU); with workers=1
+    everything runs in this process.
+    """
+    if analyze is None:
+        analyze = partial(summarize, embedded=spec.embedded)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    chunks = chunked(spec.tasks(), chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            for results in marshal.loads(run_chunk(chunk, analyze)):
+                yield from results
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() hands back results in submission order, whichever worker ran them
+        for data in executor.map(partial(run_chunk, analyze=analyze), chunks):
+            for results in marshal.loads(data):
+                yield from results
+
+
+def int_list(s: str) -> List[int]:
+    return [int(i) for i in s.split(',')]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Build and summarize every CPS in a factor space, as JSON lines",
+        prog="cps_sweep.py"
+    )
+
+    parser.add_argument("-f", "--factors", help="Comma-separated factors to choose from",
+                        action="store", dest="factors", type=int_list, required=True)
+    parser.add_argument("-n", "--sizes", help="Comma-separated numbers of factors per CPS",
+                        action="store", dest="sizes", type=int_list, required=True)
+    parser.add_argument("-c", "--choose", help="Comma-separated choose values",
+                        action="store", dest="chooses", type=int_list, required=True)
+    parser.add_argument("-t", "--transpositions",
+                        help="'all', 'none' or comma-separated divisors (default: %(default)s)",
+                        action="store", dest="transpositions", default="none")
+    parser.add_argument("-e", "--embedded", help="Count embedded CPS of this size,choose",
+                        action="store", dest="embedded", type=int_list, default=None)
+    parser.add_argument("-w", "--workers", help="Number of worker processes (default: one per CPU)",
+                        action="store", dest="workers", type=int, default=None)
+    parser.add_argument("-o", "--out", help="Output file (default: stdout)",
+                        action="store", dest="out", default=None)
+
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    transpositions = args.transpositions
+    try:
+        if transpositions not in ("all", "none"):
+            transpositions = int_list(transpositions)
+        spec = SweepSpec(args.factors, args.sizes, args.chooses, transpositions, args.embedded)
+    except ValueError as e:
+        print(f"cps_sweep.py: error: {e}", file=sys.stderr)
+        return 2
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        for result in run_sweep(spec, workers=args.workers):
+            out.write(json.dumps(result))
+            out.write('\n')
+    finally:
+        if args.out:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
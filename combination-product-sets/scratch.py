@@ -2,7 +2,10 @@
 Scratch pad
 """
 
+import sys
+
 from cps import CpsElement, CPS
+from cps_export import *
 from cps_functions import *
 
 
@@ -20,15 +23,17 @@ print_cps(eikosany)
 # print_hexanies2(eikosany)
 
 # hexanies = transpose_and_spawn(eikosany, (1*3*5, "1*3*5"), 4, 2)
-# eikosany.transpose(1*3*5, "1*3*5")
+# eikosany = eikosany.transpose(1*3*5, "1*3*5")
 # print_cps(eikosany)
 # print()
 
 # for i in range(11):
 #     print_hexanies_common_tones(eikosany, hexanies, i)
 
+# print_common_tone_paths(eikosany, hexanies)
+
 # print("\nSequence with common tones, eikosany 1/1 = 1*5*13\n")
-# eikosany.transpose(1*5*13, "1*5*13")
+# eikosany = eikosany.transpose(1*5*13, "1*5*13")
 # print_cps(eikosany)
 # print()
 # hexanies = transpose_and_spawn(eikosany, (1*5*13, "1*5*13"), 4, 2)
@@ -95,13 +100,7 @@ print_cps(eikosany)
 # for s in srtd:
 #     print(f"{s.name_csv},{s.list_scale(tabular=True, csv=True)}")
 
-# for i, s in enumerate(srtd):
-#     # print(f"; {s.name}")
-#     # print(f"{s.list_scale(csv=True)}")
-#     print(f"; {s.name}\n"
-#           f"gi_tab_{i} = ftgen(0, 0, 128, -51,\n"
-#           f"                   6, 2, 297.989, 60,\n"
-#           f"                   {s.list_scale(csv=True)})\n")
+# write_gen51(sys.stdout, srtd)
 
 # print("\n===== by ratios, reversed =====\n")
 # srtd = sorted(hexanies, key=lambda cps: cps.ratios[::-1], reverse=True)
@@ -0,0 +1,86 @@
+"""
+Regression tests for the CPS library, run with pytest from this directory.
+"""
+
+import pytest
+
+from cps import CPS
+from cps_graph import CommonToneGraph
+
+
+def common_tones_by_products(cps_list, index):
+    """
+    Groups of find_common_tones() computed directly from the products of each
+    CPS, i.e. by comparing tones rather than positions in the parent.
+    """
+    selected = cps_list[index].products
+    groups = {}
+    for i, cps in enumerate(cps_list):
+        if i != index:
+            groups.setdefault(len(selected & cps.products), []).append(cps.name)
+    return groups
+
+
+def names_by_count(groups):
+    return {k: [cps.name for cps in v] for k, v in groups.items() if v}
+
+
+def composite_hexanies(transpose=None):
+    # 3*15 == 5*9, so different elements of the parent can be the same tone
+    parent = CPS([1, 3, 5, 7, 9, 15], 3)
+    if transpose:
+        parent = parent.transpose(*transpose)
+    return parent.find_embedded_cps(4, 2, transpose)
+
+
+def test_common_tones_composite_factors():
+    for transpose in (None, (15, "3*5")):
+        hexanies = composite_hexanies(transpose)
+        for index in range(len(hexanies)):
+            assert names_by_count(CPS.find_common_tones(hexanies, index)) == \
+                common_tones_by_products(hexanies, index)
+
+
+def test_common_tones_coincident_tone_counted_once():
+    hexanies = composite_hexanies()
+    groups = names_by_count(CPS.find_common_tones(hexanies, 0))
+    assert "[1, 3, 7, 15]*9" in groups[4]
+
+
+def test_common_tone_graph_weights_composite_factors():
+    hexanies = composite_hexanies()
+    graph = CommonToneGraph(hexanies, 0)
+    for i, a in enumerate(hexanies):
+        for j, b in enumerate(hexanies):
+            if i != j:
+                assert graph.weight(i, j) == len(a.products & b.products)
+
+
+def test_common_tone_matrix_composite_factors():
+    np = pytest.importorskip("numpy")
+    from cps_numpy import common_tone_matrix
+
+    hexanies = composite_hexanies()
+    expected = np.array([[len(a.products & b.products) for b in hexanies] for a in hexanies])
+    assert (common_tone_matrix(hexanies) == expected).all()
+
+
+def test_embedded_cps_repeated_factors():
+    # elements of a parent with repeated factors can't be ranked, so they're
+    # located by their factors
+    parent = CPS([1, 3, 3, 5, 7, 11], 3)
+    for transpose in (None, (15, "3*5")):
+        embedded = parent.find_embedded_cps(4, 2, transpose)
+        assert len(embedded) == 21
+        assert embedded[0].name == "[1, 3, 5]*7"
+        for cps in embedded:
+            assert sorted(cps.relative_index) == sorted(parent.map[str(elm.factors)] for elm in cps.elements)
+
+
+def test_best_tour_search_limit():
+    hexanies = composite_hexanies()
+    graph = CommonToneGraph(hexanies, 1)
+    # with too few steps to finish any tour, fall back to a greedy one
+    total, tour = graph.best_tour(limit=1)
+    assert len(tour) == len(hexanies) and len(set(map(id, tour))) == len(hexanies)
+    assert total == sum(len(a.products & b.products) for a, b in zip(tour, tour[1:]))
@@ -0,0 +1,25 @@
+"""
+Tests for cps_sweep.py, run with pytest from this directory.
+"""
+
+from cps import CPS
+from cps_sweep import SweepSpec, run_sweep, summarize
+
+
+def test_summarize_repeated_factors():
+    # the embedded hexanies of a parent with repeated factors are counted too
+    result = summarize(CPS([1, 3, 3, 5, 7, 11], 3), embedded=(4, 2))
+    assert result[-2:] == (21, 0)
+
+
+def test_summarize_unison_is_exact():
+    cps = CPS([1, 3, 5, 7], 2).transpose(3, "3")
+    *_, count, with_unison = summarize(cps, embedded=(3, 1))
+    expected = sum(1 for child in cps.iter_embedded_cps(3, 1, (3, "3"))
+                   if any(elm.ratio == '1/1' for elm in child.elements))
+    assert (count, with_unison) == (4, expected)
+
+
+def test_sweep_runs_every_spec():
+    spec = SweepSpec([1, 3, 3, 5, 7, 11], [6], [3], embedded=(4, 2))
+    assert [result[-2:] for result in run_sweep(spec, workers=1)] == [(21, 0)]
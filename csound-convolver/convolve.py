@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import glob
 import os
+import shlex
+import subprocess
 import sys
 import textwrap
+import time
 
 
-VERSION = "1.1"
+VERSION = "1.5"
 CSD_NAME = "convolver.csd"
+ENGINES = ["csound", "numpy"]
+
+# lines of a failed job's output shown in the batch report
+FAILED_OUTPUT_LINES = 20
 
 
 def parse_args(argv):
@@ -17,50 +27,345 @@ def parse_args(argv):
     )
 
     parser.add_argument("-i", "--in", help="Pathname of input sound file",
-        action="store", dest="sound_file_in", default=None, required=True)
+        action="store", dest="sound_file_in", default=None)
     parser.add_argument("-o", "--out", help="Pathname of output sound file",
-        action="store", dest="sound_file_out", default=None, required=True)
+        action="store", dest="sound_file_out", default=None)
     parser.add_argument("-1", "--ir1", help="Pathname of IR file 1",
-        action="store", dest="ir_file1", default=None, required=True)
+        action="store", dest="ir_file1", default=None)
     parser.add_argument("-2", "--ir2", help="Pathname of IR file 2 (optional)",
         action="store", dest="ir_file2", default=None)
     parser.add_argument("-g", "--gain", help="Gain multiplier applied to output (default: %(default)s)",
         action="store", dest="gain", type=float, default=1.0)
-    parser.add_argument("-s", "--sr", help="Sample rate (default: %(default)s)",
+    parser.add_argument("-w", "--wet", help="Proportion of convolved (wet) signal in the output, mixed with "
+                        "the input, 0 to 1 (default: %(default)s)",
+        action="store", dest="wet", type=float, default=1.0)
+    parser.add_argument("-c", "--compensate", help="numpy engine: remove the latency, so that the output "
+                        "lines up with the input",
+        action="store_true", dest="compensate", default=False)
+    parser.add_argument("-s", "--sr", help="Sample rate of the Csound engine's output; the numpy engine "
+                        "renders at the input's sample rate (default: %(default)s)",
         action="store", dest="sr", type=int, default=48000)
+    parser.add_argument("-f", "--float", help="Write 32-bit float samples instead of 24-bit",
+        action="store_true", dest="float", default=False)
+    parser.add_argument("-e", "--engine", help="Convolution engine (default: %(default)s)",
+        action="store", dest="engine", choices=ENGINES, default="csound")
+    parser.add_argument("-p", "--partsize", help="FFT partition size of the numpy engine (default: 8192)",
+        action="store", dest="partsize", type=int, default=None)
+    parser.add_argument("--ir-cache", help="Directory for resampled IRs and IR spectra "
+                        "(default: ~/.cache/convolve)",
+        action="store", dest="ir_cache", default=None)
+    parser.add_argument("--no-ir-cache", help="Don't cache resampled IRs and IR spectra",
+        action="store_true", dest="no_ir_cache", default=False)
+    parser.add_argument("-b", "--batch", help="CSV manifest of jobs: input,ir1[,ir2[,output]] per line",
+        action="store", dest="manifest", default=None)
+    parser.add_argument("--inputs", help="Batch: input files or glob patterns, each convolved with every IR",
+        action="store", dest="inputs", nargs='+', default=None)
+    parser.add_argument("--irs", help="Batch: IR files or glob patterns",
+        action="store", dest="irs", nargs='+', default=None)
+    parser.add_argument("-d", "--out-dir", help="Batch: directory for output files without a name in the "
+                        "manifest, named input-ir[-ir2].wav (default: current directory)",
+        action="store", dest="out_dir", default=".")
+    parser.add_argument("-j", "--jobs", help="Batch: number of worker processes (default: one per CPU)",
+        action="store", dest="jobs", type=int, default=None)
     parser.add_argument('-v', "--version", action='version', version='%(prog)s ' + VERSION)
 
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if not 0 <= args.wet <= 1:
+        parser.error("wet must be between 0 and 1")
+    if args.compensate and args.engine != "numpy":
+        parser.error("-c/--compensate needs the numpy engine")
+    if args.manifest or args.inputs or args.irs:
+        if not args.manifest and not (args.inputs and args.irs):
+            parser.error("batch mode needs a manifest (-b) or both --inputs and --irs")
+    elif not (args.sound_file_in and args.sound_file_out and args.ir_file1):
+        parser.error("the following arguments are required: -i/--in, -o/--out, -1/--ir1")
+    return args
+
+
+def csd_path():
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), CSD_NAME)
+
+
+def csound_command(job):
+    return ["csound", "-m0", "-d",
+            "--sample-rate={}".format(job["sr"]),
+            "--ksmps={}".format(1),
+            "--omacro:INFILE={}".format(job["sound_file_in"]),
+            "--omacro:IRFILE1={}".format(job["ir_file1"]),
+            "--omacro:IRFILE2={}".format(job["ir_file2"]),
+            "--omacro:GAIN={}".format(job["gain"]),
+            "--omacro:WET={}".format(job["wet"]),
+            "-W", "-f" if job["float"] else "-3",
+            "-o", job["sound_file_out"],
+            job["csd_file"]]
+
+
+def make_job(args, sound_file_in, sound_file_out, ir_file1, ir_file2=None):
+    return {
+        "engine": args.engine,
+        "sound_file_in": sound_file_in,
+        "sound_file_out": sound_file_out,
+        "ir_file1": ir_file1,
+        "ir_file2": ir_file2 if ir_file2 else ir_file1,
+        "gain": args.gain,
+        "wet": args.wet,
+        "compensate": args.compensate,
+        "sr": args.sr,
+        "float": args.float,
+        "partsize": args.partsize,
+        "csd_file": csd_path(),
+        # None for no cache, "" for the default directory
+        "ir_cache": None if args.no_ir_cache else args.ir_cache or "",
+    }
+
+
+def open_ir_cache(job):
+    """
+    The job's fftconv.IRCache, or None if it has none or NumPy isn't available.
+    """
+    if job["ir_cache"] is None:
+        return None
+    try:
+        import fftconv
+    except ImportError:
+        return None
+    return fftconv.IRCache(job["ir_cache"])
+
+
+def resample_irs(job):
+    """
+    The job with its IR files replaced by copies resampled to its sample rate
+    (from the IR cache), where they differ; pconvolve doesn't resample them.
+    IR files that aren't WAV files (e.g. AIFF or FLAC, which pconvolve reads
+    too) are passed through unchanged.
+    """
+    cache = open_ir_cache(job)
+    if cache is None:
+        return job
+    import fftconv
+    resampled = {}
+    for key in ("ir_file1", "ir_file2"):
+        ir_sr = fftconv.wav_sample_rate(job[key])
+        if ir_sr is not None and ir_sr != job["sr"]:
+            resampled[key] = cache.ir_file(job[key], job["sr"])
+    return dict(job, **resampled)
+
+
+def run_job(job):
+    """
+    Run one convolution job in this process (numpy engine) or in a Csound
+    subprocess, and return the job with its exit status ("status"), captured
+    output ("output") and run time in seconds ("elapsed").
+    """
+    start = time.perf_counter()
+    if job["engine"] == "numpy":
+        try:
+            import fftconv
+            frames = fftconv.convolve_file(job["sound_file_in"], job["sound_file_out"],
+                                           job["ir_file1"], job["ir_file2"], job["gain"],
+                                           job["partsize"] or fftconv.PARTSIZE,
+                                           0 if job["float"] else 3, open_ir_cache(job), job["wet"],
+                                           0 if job["compensate"] else fftconv.CSD_LATENCY)
+            status, output = 0, "{} frames\n".format(frames)
+        except (ImportError, OSError, EOFError, ValueError) as e:
+            status, output = 1, "Can't convolve {}: {}\n".format(job["sound_file_in"], e)
+    else:
+        try:
+            command = csound_command(resample_irs(job))
+        except (OSError, EOFError, ValueError) as e:
+            command = None
+            status, output = 1, "Can't resample the IRs: {}\n".format(e)
+        try:
+            if command:
+                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True)
+                status, output = result.returncode, result.stdout
+        except OSError as e:
+            status, output = 1, "Can't run Csound: {}\n".format(e)
+    return dict(job, status=status, output=output, elapsed=time.perf_counter() - start)
+
+
+def expand(patterns):
+    """
+    Files matching each of the glob patterns (or the names themselves, for
+    names that aren't patterns), in order, without duplicates.
+    """
+    files = []
+    for pattern in patterns:
+        for name in sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]:
+            if name not in files:
+                files.append(name)
+    return files
+
+
+def output_name(out_dir, sound_file_in, ir_file1, ir_file2=None):
+    stem = lambda path: os.path.splitext(os.path.basename(path))[0]
+    stems = [stem(sound_file_in), stem(ir_file1)]
+    if ir_file2 and ir_file2 != ir_file1:
+        stems.append(stem(ir_file2))
+    return os.path.join(out_dir, "-".join(stems) + ".wav")
+
+
+def batch_jobs(args):
+    """
+    The jobs listed in the manifest, followed by every combination of the
+    --inputs and --irs files. Raises ValueError if two jobs would write the
+    same output file.
+    """
+    jobs = []
+    if args.manifest:
+        with open(args.manifest, newline='') as f:
+            for row in csv.reader(f):
+                row = [field.strip() for field in row]
+                if not row or not row[0] or row[0].startswith('#'):
+                    continue
+                if len(row) < 2:
+                    raise ValueError("Manifest line needs an input and an IR: {}".format(','.join(row)))
+                sound_file_in, ir_file1 = row[0], row[1]
+                ir_file2 = row[2] if len(row) > 2 and row[2] else None
+                sound_file_out = row[3] if len(row) > 3 and row[3] else \
+                    output_name(args.out_dir, sound_file_in, ir_file1, ir_file2)
+                jobs.append(make_job(args, sound_file_in, sound_file_out, ir_file1, ir_file2))
+
+    if args.inputs and args.irs:
+        irs = expand(args.irs)
+        for sound_file_in in expand(args.inputs):
+            for ir_file in irs:
+                sound_file_out = output_name(args.out_dir, sound_file_in, ir_file, args.ir_file2)
+                jobs.append(make_job(args, sound_file_in, sound_file_out, ir_file, args.ir_file2))
+
+    # e.g. inputs with the same name in different directories
+    outputs = {}
+    for job in jobs:
+        key = os.path.normcase(os.path.abspath(job["sound_file_out"]))
+        if key in outputs:
+            other = outputs[key]
+            raise ValueError("{} * {} and {} * {} would both be written to {}".format(
+                other["sound_file_in"], other["ir_file1"], job["sound_file_in"], job["ir_file1"],
+                job["sound_file_out"]))
+        outputs[key] = job
+    return jobs
+
+
+def run_batch(args):
+    try:
+        jobs = batch_jobs(args)
+    except (OSError, ValueError) as e:
+        print("Can't read the batch: {}".format(e))
+        return 1
+    if not jobs:
+        print("No jobs to run")
+        return 1
+    if args.engine == "csound" and not os.path.exists(csd_path()):
+        print("Can't find CSD file: {}".format(csd_path()))
+        return 1
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    workers = args.jobs or os.cpu_count() or 1
+    print("Running {} job(s) with the {} engine on {} worker(s)\n".format(len(jobs), args.engine, workers))
+
+    start = time.perf_counter()
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_job, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            print("{:<6} {:8.2f}s  {} * {} -> {}".format(
+                "ok" if result["status"] == 0 else "FAILED", result["elapsed"], result["sound_file_in"],
+                result["ir_file1"], result["sound_file_out"]))
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if r["status"] != 0]
+    for result in failed:
+        print("\n{} * {} exited with status {}:".format(result["sound_file_in"], result["ir_file1"], result["status"]))
+        print(''.join(result["output"].splitlines(True)[-FAILED_OUTPUT_LINES:]).rstrip())
+
+    print("\n{} job(s), {} failed, in {:.2f} seconds ({:.2f} seconds of work)".format(
+        len(results), len(failed), elapsed, sum(r["elapsed"] for r in results)))
+    return 1 if failed else 0
+
+
+def run_numpy(args, ir_file1, ir_file2):
+    try:
+        import fftconv
+    except ImportError as e:
+        print("The numpy engine needs NumPy: {}".format(e))
+        return 1
+    job = make_job(args, args.sound_file_in, args.sound_file_out, ir_file1, ir_file2)
+
+    partsize = args.partsize or fftconv.PARTSIZE
+    # the output has the input's sample rate, whatever -s says
+    sr = fftconv.wav_sample_rate(args.sound_file_in) or args.sr
+    print(textwrap.dedent('''
+    input file: {}
+    gain adjustment: {}
+    wet/dry mix: {:g}/{:g}
+    impulse response file 1: {}
+    impulse response file 2: {}
+    output file: {}
+
+    Engine: numpy, partition size {}
+    ''').format(args.sound_file_in, args.gain, args.wet, 1 - args.wet, ir_file1, ir_file2,
+                args.sound_file_out, partsize))
+    print("{} a latency of {:f} seconds ({} samples)".format(
+        "Compensating for" if args.compensate else "Convolving with",
+        fftconv.CSD_LATENCY / sr, fftconv.CSD_LATENCY))
+
+    start = time.perf_counter()
+    try:
+        frames = fftconv.convolve_file(args.sound_file_in, args.sound_file_out, ir_file1, ir_file2,
+                                       args.gain, partsize, 0 if args.float else 3, open_ir_cache(job),
+                                       args.wet, 0 if args.compensate else fftconv.CSD_LATENCY)
+    except (OSError, EOFError, ValueError) as e:
+        print("Can't convolve {}: {}".format(args.sound_file_in, e))
+        return 1
+    elapsed = time.perf_counter() - start
+    print("{} frames in {:.2f} seconds ({:.1f}x realtime)".format(
+        frames, elapsed, frames / sr / elapsed if elapsed else float('inf')))
+    return 0
 
 
 def main(argv):
     args = parse_args(argv)
 
-    csd_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), CSD_NAME)
+    if args.manifest or args.inputs:
+        return run_batch(args)
+
+    ir_file1 = args.ir_file1
+    ir_file2 = args.ir_file2 if args.ir_file2 else ir_file1
+
+    if args.engine == "numpy":
+        return run_numpy(args, ir_file1, ir_file2)
+
+    csd_file = csd_path()
     if not os.path.exists(csd_file):
         print("Can't find CSD file: {}".format(csd_file))
         return 1
 
-    ir_file1 = args.ir_file1
-    if hasattr(args, "ir_file2"):
-        ir_file2 = ir_file1
-    else:
-        ir_file2 = args.ir_file2
-
-    csound_cmd = 'csound -m0 -d --sample-rate={} --ksmps={} --omacro:INFILE="{}" --omacro:IRFILE1="{}" --omacro:IRFILE2="{}" --omacro:GAIN={} -W -3 -o "{}" "{}"'\
-        .format(args.sr, 1, args.sound_file_in, ir_file1, ir_file2, args.gain, args.sound_file_out, csd_file)
+    try:
+        job = resample_irs(make_job(args, args.sound_file_in, args.sound_file_out, ir_file1, ir_file2))
+    except (OSError, EOFError, ValueError) as e:
+        print("Can't resample the IRs: {}".format(e))
+        return 1
+    csound_cmd = csound_command(job)
 
     print(textwrap.dedent('''
     input file: {}
     gain adjustment: {}
+    wet/dry mix: {:g}/{:g}
     impulse response file 1: {}
     impulse response file 2: {}
     output file: {}
 
     Csound command: {}\n
-    ''').format(args.sound_file_in, args.gain, args.ir_file1, args.ir_file2, args.sound_file_out, csound_cmd))
+    ''').format(args.sound_file_in, args.gain, args.wet, 1 - args.wet, ir_file1, ir_file2, args.sound_file_out,
+                ' '.join(shlex.quote(arg) for arg in csound_cmd)))
 
-    return os.system(csound_cmd)
+    try:
+        return subprocess.run(csound_cmd).returncode
+    except OSError as e:
+        print("Can't run Csound: {}".format(e))
+        return 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,526 @@
+"""
+In-process convolution engine for convolve.py, using NumPy: uniformly
+partitioned overlap-add FFT convolution, with the same channel routing,
+gain, dry/wet mix and latency as convolver.csd, so that it produces the same
+output without running Csound.
+
+The routing of convolver.csd is that each input channel is convolved with its
+own (stereo) IR file, input 1 with IR 1 and input 2 with IR 2, and each output
+channel is the sum of the two convolutions for that channel of the IRs:
+
+    out L = in 1 * IR 1 left  + in 2 * IR 2 left
+    out R = in 1 * IR 1 right + in 2 * IR 2 right
+
+pconvolve delays its output by its partition size plus ksmps samples, and the
+CSD renders exactly as many frames as the input has, so the engine delays its
+output by the same amount (CSD_LATENCY) and cuts it to the input's length.
+Like the convolver UDO, it delays the dry part of a dry/wet mix by the same
+amount, so that the two line up. Being offline, it can also drop the latency
+altogether (latency=0), giving output aligned with the input.
+
+The input is streamed: it is read one partition at a time from a memory map of
+the file, convolved with the overlap carried over from the previous partition,
+and written out as it goes, so memory use depends on the length of the IRs
+and the partition size, not on the length of the input. WAV files may be PCM
+(8, 16, 24 or 32-bit) or floating point, and RF64 for files over 4 GB.
+
+IRs at a sample rate other than the target rate are resampled. An IRCache keeps
+resampled IRs (as WAV files, which the Csound engine can use too) and the
+partition spectra of IR pairs (as .npy files, loaded memory-mapped) on disk,
+keyed by the hash of the IR files' contents, the sample rate and the partition
+size, so that rendering with the same IRs again skips that work.
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+
+# partition size and ksmps used by convolver.csd / convolve.py, which set the
+# latency of its output
+CSD_PARTSIZE = 1024
+CSD_KSMPS = 1
+CSD_LATENCY = CSD_PARTSIZE + CSD_KSMPS
+
+# default partition size of the FFT engine; larger partitions mean fewer of
+# them, and so less work per sample, and latency doesn't matter offline
+PARTSIZE = 8192
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# largest size that fits the 32-bit size fields of a RIFF file
+RIFF_MAX_SIZE = 0xFFFFFFFF
+
+# part of the names of cached files; change it when their contents change
+IR_CACHE_VERSION = 1
+
+
+def pcm_to_float(raw, format_tag, width, channels):
+    """
+    Convert little-endian sample bytes (a bytes object or uint8 array) to
+    floats, PCM scaled to -1..1, shaped (frames, channels).
+    """
+    raw = np.frombuffer(raw, dtype=np.uint8)
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        samples = raw.view('<f{}'.format(width)).astype(np.float64)
+    elif format_tag != WAVE_FORMAT_PCM:
+        raise ValueError("Unsupported WAV format: {}".format(format_tag))
+    elif width == 1:
+        samples = (raw.astype(np.float64) - 128) / 128
+    elif width == 3:
+        ints = raw.reshape(-1, 3).astype(np.int32)
+        ints = ints[:, 0] | (ints[:, 1] << 8) | (ints[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints / float(1 << 23)
+    elif width in (2, 4):
+        samples = raw.view('<i{}'.format(width)) / float(1 << (8 * width - 1))
+    else:
+        raise ValueError("Unsupported sample width: {} bytes".format(width))
+    return samples.reshape(-1, channels)
+
+
+def float_to_pcm(samples, width):
+    """
+    Convert floats in -1..1 to little-endian PCM sample bytes, clipping values
+    out of range as Csound does when writing integer formats.
+    """
+    scale = 1 << (8 * width - 1)
+    ints = np.clip(np.round(samples * scale), -scale, scale - 1).astype(np.int32).ravel()
+    if width == 3:
+        return ints.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    if width == 2:
+        return ints.astype('<i2').tobytes()
+    if width == 4:
+        return ints.astype('<i4').tobytes()
+    raise ValueError("Unsupported sample width: {} bytes".format(width))
+
+
+class WavReader(object):
+    """
+    Reads the samples of a WAV (or RF64) file through a memory map of its data
+    chunk, a block at a time.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+            if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+                raise ValueError("{} is not a WAV file".format(path))
+
+            fmt = None
+            ds64_data_size = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError("{} has no data chunk".format(path))
+                chunk, size = struct.unpack('<4sI', header)
+                if chunk == b'data':
+                    break
+                body = f.read(size + (size & 1))
+                if chunk == b'ds64':
+                    ds64_data_size = struct.unpack('<Q', body[8:16])[0]
+                elif chunk == b'fmt ':
+                    fmt = body
+
+            if fmt is None:
+                raise ValueError("{} has no fmt chunk".format(path))
+            format_tag, channels, sr, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                # the format tag is the first two bytes of the subformat GUID
+                format_tag = struct.unpack('<H', fmt[24:26])[0]
+
+            if size == RIFF_MAX_SIZE and ds64_data_size is not None:
+                size = ds64_data_size
+            offset = f.tell()
+            f.seek(0, 2)
+            size = min(size, f.tell() - offset)
+
+        self._format_tag = format_tag
+        self._channels = channels
+        self._sr = sr
+        self._width = bits // 8
+        self._block_align = block_align
+        self._frames = size // block_align
+        self._data = np.zeros(0, np.uint8)
+        if self._frames:
+            self._data = np.memmap(path, dtype=np.uint8, mode='r', offset=offset,
+                                   shape=(self._frames * block_align,))
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def sr(self):
+        return self._sr
+
+    @property
+    def frames(self):
+        return self._frames
+
+    def read(self, start=0, frames=None):
+        """
+        frames samples (default: all) from frame start, as floats shaped
+        (frames, channels).
+        """
+        end = self._frames if frames is None else min(self._frames, start + frames)
+        raw = self._data[start * self._block_align:end * self._block_align]
+        return pcm_to_float(raw, self._format_tag, self._width, self._channels)
+
+    def blocks(self, frames):
+        """
+        Generate the samples in blocks of frames (the last one may be shorter).
+        """
+        for start in range(0, self._frames, frames):
+            yield self.read(start, frames)
+
+    def close(self):
+        # dropping the reference unmaps the file
+        self._data = np.zeros(0, np.uint8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WavWriter(object):
+    """
+    Writes a WAV file incrementally, as 24-bit PCM (or 16 or 32-bit) or, with
+    width=0, as 32-bit float. The header is completed on close(); a file that
+    grows past 4 GB is written as RF64, in the space reserved for it by a JUNK
+    chunk.
+    """
+    def __init__(self, path, sr, channels=2, width=3):
+        self._float = not width
+        self._width = 4 if self._float else width
+        self._channels = channels
+        self._frames = 0
+        self._file = open(path, 'wb')
+
+        format_tag = WAVE_FORMAT_IEEE_FLOAT if self._float else WAVE_FORMAT_PCM
+        block_align = channels * self._width
+        fmt = struct.pack('<HHIIHH', format_tag, channels, sr, sr * block_align, block_align, 8 * self._width)
+        if self._float:
+            fmt += struct.pack('<H', 0)
+
+        header = [b'RIFF', struct.pack('<I', 0), b'WAVE',
+                  b'JUNK', struct.pack('<I', 28), bytes(28),
+                  b'fmt ', struct.pack('<I', len(fmt)), fmt]
+        if self._float:
+            header += [b'fact', struct.pack('<I', 4), struct.pack('<I', 0)]
+        header += [b'data', struct.pack('<I', 0)]
+        self._file.write(b''.join(header))
+        self._data_offset = self._file.tell()
+
+    @property
+    def frames(self):
+        return self._frames
+
+    def write(self, samples):
+        """
+        Append samples, shaped (frames, channels).
+        """
+        if self._float:
+            self._file.write(samples.astype('<f4').tobytes())
+        else:
+            self._file.write(float_to_pcm(samples, self._width))
+        self._frames += len(samples)
+
+    def close(self):
+        f = self._file
+        if f.closed:
+            return
+        data_size = self._frames * self._channels * self._width
+        if data_size & 1:
+            f.write(b'\0')
+        riff_size = f.tell() - 8
+
+        if riff_size > RIFF_MAX_SIZE:
+            f.seek(0)
+            f.write(b'RF64' + struct.pack('<I', RIFF_MAX_SIZE))
+            f.seek(12)
+            f.write(b'ds64' + struct.pack('<IQQQI', 28, riff_size, data_size, self._frames, 0))
+            data_size = RIFF_MAX_SIZE
+        else:
+            f.seek(4)
+            f.write(struct.pack('<I', riff_size))
+        if self._float:
+            f.seek(self._data_offset - 12)
+            f.write(struct.pack('<I', min(self._frames, RIFF_MAX_SIZE)))
+        f.seek(self._data_offset - 4)
+        f.write(struct.pack('<I', data_size))
+        f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_wav(path):
+    """
+    Read a whole WAV file, returning (samples, sample rate), where samples is
+    a float64 array of shape (frames, channels).
+    """
+    with WavReader(path) as reader:
+        return reader.read(), reader.sr
+
+
+def write_wav(path, samples, sr, width=3):
+    """
+    Write samples (frames, channels) as a WAV file, 24-bit by default (see
+    WavWriter for width).
+    """
+    with WavWriter(path, sr, samples.shape[1], width) as writer:
+        writer.write(samples)
+
+
+def resample(samples, from_sr, to_sr):
+    """
+    Resample samples (frames, channels) from from_sr to to_sr by zero-padding
+    or truncating their spectrum, which suits short signals such as IRs that
+    can be transformed in one piece. The signal is padded with silence first,
+    so that its end doesn't wrap around to its start.
+    """
+    if from_sr == to_sr or not len(samples):
+        return samples
+    padded = np.concatenate([samples, np.zeros_like(samples)])
+    frames = len(padded)
+    out_frames = int(round(frames * to_sr / from_sr))
+    spectrum = np.fft.rfft(padded, axis=0)
+    bins = min(len(spectrum), out_frames // 2 + 1)
+    resized = np.zeros((out_frames // 2 + 1, samples.shape[1]), dtype=spectrum.dtype)
+    resized[:bins] = spectrum[:bins]
+    out = np.fft.irfft(resized, n=out_frames, axis=0) * (out_frames / frames)
+    return out[:int(round(len(samples) * to_sr / from_sr))]
+
+
+def file_hash(path):
+    """
+    Hash of the contents of a file, as a hex string.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def default_cache_dir():
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "convolve")
+
+
+def wav_sample_rate(path):
+    """
+    Sample rate of a WAV file, or None if it can't be read as one.
+    """
+    try:
+        with WavReader(path) as reader:
+            return reader.sr
+    except (OSError, EOFError, ValueError, struct.error):
+        return None
+
+
+class IRCache(object):
+    """
+    A directory of resampled IRs and IR partition spectra, see the module
+    docstring, created when the first file is stored in it. Files are written
+    under temporary names and then renamed, so processes sharing a cache never
+    see partly written files.
+    """
+    def __init__(self, path=None):
+        self._path = path if path else default_cache_dir()
+
+    @property
+    def path(self):
+        return self._path
+
+    def _file(self, *key):
+        return os.path.join(self._path, '-'.join(str(k) for k in (IR_CACHE_VERSION,) + key))
+
+    def _store(self, path, write):
+        """
+        Call write() with a temporary path to write to, then move it to path.
+        """
+        os.makedirs(self._path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self._path, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def ir_file(self, path, sr):
+        """
+        path if the IR in it is at sample rate sr, otherwise the path of a
+        copy resampled to sr (as float samples), made on first use.
+        """
+        with WavReader(path) as reader:
+            if reader.sr == sr:
+                return path
+        cached = self._file(file_hash(path), sr) + ".wav"
+        if not os.path.exists(cached):
+            samples, ir_sr = read_wav(path)
+            resampled = resample(samples, ir_sr, sr)
+            self._store(cached, lambda tmp: write_wav(tmp, resampled, sr, 0))
+        return cached
+
+    def spectra(self, ir_file1, ir_file2, sr, partsize):
+        """
+        ir_spectra() of the IR pair at sample rate sr, memory-mapped from the
+        cache, and computed and stored on first use.
+        """
+        ir_file1, ir_file2 = self.ir_file(ir_file1, sr), self.ir_file(ir_file2, sr)
+        cached = self._file(file_hash(ir_file1), file_hash(ir_file2), sr, partsize) + ".npy"
+        if not os.path.exists(cached):
+            spectra = ir_spectra([read_wav(ir_file1)[0], read_wav(ir_file2)[0]], partsize)
+
+            def write(tmp):
+                with open(tmp, 'wb') as f:
+                    np.save(f, spectra)
+            self._store(cached, write)
+        return np.load(cached, mmap_mode='r')
+
+
+def load_spectra(ir_file1, ir_file2, sr, partsize, cache=None):
+    """
+    ir_spectra() of the IR pair, resampled to sr if necessary, from cache (an
+    IRCache) if given.
+    """
+    if cache is not None:
+        return cache.spectra(ir_file1, ir_file2, sr, partsize)
+    irs = []
+    for path in (ir_file1, ir_file2):
+        samples, ir_sr = read_wav(path)
+        irs.append(resample(samples, ir_sr, sr))
+    return ir_spectra(irs, partsize)
+
+
+def stereo(samples):
+    """
+    samples with a mono channel duplicated to two, or the first two channels.
+    """
+    if samples.shape[1] == 1:
+        return np.repeat(samples, 2, axis=1)
+    return samples[:, :2]
+
+
+def ir_spectra(irs, partsize):
+    """
+    Spectra of the partitions of the IRs, one stereo IR per input channel,
+    shaped (partitions, inputs, outputs, bins), for an FFT size of twice
+    partsize.
+    """
+    irs = [stereo(ir) for ir in irs]
+    length = max(len(ir) for ir in irs)
+    count = max(1, -(-length // partsize))
+    padded = np.zeros((count * partsize, len(irs), 2))
+    for i, ir in enumerate(irs):
+        padded[:len(ir), i, :] = ir
+    parts = padded.reshape(count, partsize, len(irs), 2)
+    return np.fft.rfft(parts, n=2 * partsize, axis=1).transpose(0, 2, 3, 1).copy()
+
+
+class PartitionedConvolver(object):
+    """
+    Uniformly partitioned overlap-add convolution of a multichannel input
+    with one stereo IR per input channel (see ir_spectra()), one block of
+    partsize frames at a time, carrying the overlap and the spectra of
+    earlier blocks over from one block to the next.
+    """
+    def __init__(self, spectra, partsize):
+        self._spectra = spectra
+        self._partsize = partsize
+        count, inputs, _, bins = spectra.shape
+        # spectra of the last count input blocks, stored twice over so that
+        # _history[self._pos:self._pos + count] always holds them newest first
+        self._count = count
+        self._history = np.zeros((2 * count, inputs, bins), dtype=np.complex128)
+        self._pos = 0
+        self._overlap = np.zeros((partsize, 2))
+
+    @property
+    def partsize(self):
+        return self._partsize
+
+    def process(self, block):
+        """
+        Convolve the next block of input, shaped (partsize, inputs), and return
+        the next partsize frames of stereo output.
+        """
+        self._pos = (self._pos - 1) % self._count
+        self._history[self._pos] = self._history[self._pos + self._count] = \
+            np.fft.rfft(block, n=2 * self._partsize, axis=0).T
+        history = self._history[self._pos:self._pos + self._count]
+        spectrum = np.einsum('kib,kiob->ob', history, self._spectra)
+        out = np.fft.irfft(spectrum, n=2 * self._partsize, axis=1).T
+        result = out[:self._partsize] + self._overlap
+        self._overlap = out[self._partsize:]
+        return result
+
+
+def delayed_blocks(blocks, size, delay, gain=1.0):
+    """
+    Regroup a stream of sample blocks (of any length) into stereo blocks of
+    size frames, scaled by gain and preceded by delay frames of silence. The
+    last block is padded with silence.
+    """
+    carry = np.zeros((delay, 2))
+    for block in blocks:
+        buf = np.concatenate([carry, stereo(block) * gain])
+        end = len(buf) - len(buf) % size
+        for start in range(0, end, size):
+            yield buf[start:start + size]
+        carry = buf[end:]
+    if len(carry):
+        yield np.concatenate([carry, np.zeros((size - len(carry), 2))])
+
+
+def convolve_stream(blocks, frames, writer, spectra, gain=1.0, partsize=PARTSIZE, latency=CSD_LATENCY, wet=1.0):
+    """
+    Convolve a stream of input blocks (frames in all) with IRs, given as their
+    ir_spectra() for partsize, as convolver.csd does: scaled by gain, mixed
+    with 1 - wet of the (scaled) input, delayed by latency frames and cut to
+    the length of the input, passing each block of output to writer.write()
+    as soon as it is computed. The dry input is delayed together with the
+    convolved signal, so the two are aligned for any latency.
+    """
+    convolver = PartitionedConvolver(spectra, partsize)
+    dry = 1.0 - wet
+    remaining = frames
+    for block in delayed_blocks(blocks, partsize, latency, gain):
+        if remaining <= 0:
+            break
+        out = convolver.process(block)
+        if dry > 0:
+            out = wet * out + dry * block
+        writer.write(out[:remaining])
+        remaining -= len(out)
+
+
+def convolve_file(sound_file_in, sound_file_out, ir_file1, ir_file2, gain=1.0, partsize=PARTSIZE,
+                  width=3, cache=None, wet=1.0, latency=CSD_LATENCY):
+    """
+    Equivalent of running convolver.csd on the files, streaming the input and
+    writing the output as a WAV file of the given sample width (see WavWriter).
+    The output has the input's sample rate (Csound resamples the input to its
+    own instead), and IRs are resampled to it if necessary; their spectra are
+    taken from cache (an IRCache) if given. wet is the proportion of convolved
+    signal in the output, the rest being the input; latency 0 gives output
+    aligned with the input instead of delayed as with Csound.
+    Returns the number of frames written.
+    """
+    with WavReader(sound_file_in) as reader:
+        spectra = load_spectra(ir_file1, ir_file2, reader.sr, partsize, cache)
+        with WavWriter(sound_file_out, reader.sr, 2, width) as writer:
+            convolve_stream(reader.blocks(partsize), reader.frames, writer, spectra, gain, partsize, latency, wet)
+            return writer.frames
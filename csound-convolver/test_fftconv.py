@@ -0,0 +1,57 @@
+"""
+Tests for fftconv.py, run with pytest from this directory.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import fftconv
+
+
+class ListWriter(object):
+    def __init__(self):
+        self.blocks = []
+
+    def write(self, block):
+        self.blocks.append(np.array(block))
+
+    @property
+    def samples(self):
+        return np.concatenate(self.blocks)
+
+
+def direct_convolution(samples, irs, gain, latency, wet):
+    """
+    What convolve_stream() should write, computed with np.convolve: input
+    channel i is convolved with the stereo IR i, and the sum is mixed with the
+    input, delayed by latency and cut to the length of the input.
+    """
+    frames = len(samples)
+    out = np.zeros((frames + max(len(ir) for ir in irs) - 1, 2))
+    for i, ir in enumerate(irs):
+        for o in range(2):
+            conv = np.convolve(samples[:, i], ir[:, o])
+            out[:len(conv), o] += conv
+    out = wet * gain * out[:frames] + (1 - wet) * gain * samples
+    return np.concatenate([np.zeros((latency, 2)), out])[:frames]
+
+
+@pytest.mark.parametrize("partsize", [64, 256, 1024, 8192, 65536])
+@pytest.mark.parametrize("latency", [0, fftconv.CSD_LATENCY])
+@pytest.mark.parametrize("wet", [1.0, 0.3])
+def test_convolve_stream_matches_np_convolve(partsize, latency, wet):
+    rng = np.random.default_rng(partsize)
+    samples = rng.uniform(-0.5, 0.5, (20000, 2))
+    irs = [rng.uniform(-0.1, 0.1, (3000, 2)) * np.exp(-np.arange(3000) / 500)[:, np.newaxis],
+           rng.uniform(-0.1, 0.1, (2000, 2))]
+    writer = ListWriter()
+    # blocks of an awkward size, so that they have to be regrouped
+    blocks = (samples[start:start + 1000] for start in range(0, len(samples), 1000))
+    fftconv.convolve_stream(blocks, len(samples), writer, fftconv.ir_spectra(irs, partsize),
+                            0.8, partsize, latency, wet)
+
+    expected = direct_convolution(samples, irs, 0.8, latency, wet)
+    assert writer.samples.shape == expected.shape
+    assert np.abs(writer.samples - expected).max() < 1e-9
+